@@ -2,7 +2,6 @@ import asyncio
 import time
 import aiohttp
 import httpx
-import uuid
 import orjson
 
 from fastapi import APIRouter, Request, BackgroundTasks
@@ -16,24 +15,62 @@ from starlette.background import BackgroundTask
 from RTN import Torrent, sort_torrents
 
 from comet.debrid.manager import getDebrid
+from comet.utils.availability import (
+    availability_cache,
+    availability_stats,
+    get_season_episodes,
+    select_files,
+)
 from comet.utils.general import (
     config_check,
     get_debrid_extension,
     get_indexer_manager,
+    indexer_manager_stats,
     get_zilean,
     get_torrentio,
     get_mediafusion,
     filter,
-    get_torrent_hash,
+    rank_torrents,
+    get_torrent_hashes,
     translate,
     get_balanced_hashes,
     format_title,
     get_client_ip,
-    get_aliases,
     add_torrent_to_cache,
+    parse_cache,
+    torrent_hash_cache,
+    torrent_hash_stats,
+)
+from comet.utils.bandwidth import bandwidth
+from comet.utils.chunk_cache import chunk_cache
+from comet.utils.clients import clients
+from comet.utils.connections import connections
+from comet.utils.download_links import (
+    get_download_link,
+    cache_download_link,
+    download_links_cache,
+    pregenerate_download_links,
+    pregeneration_stats,
 )
 from comet.utils.logger import logger
-from comet.utils.models import database, rtn, settings, trackers
+from comet.utils.metadata import (
+    get_metadata,
+    get_aliases,
+    metadata_cache,
+    metadata_stats,
+    aliases_cache,
+    aliases_stats,
+)
+from comet.utils.models import database, settings, trackers
+from comet.utils.singleflight import single_flight
+from comet.utils.streaming import (
+    first_segment_range,
+    iter_range,
+    iter_response,
+    parse_content_range,
+    parse_range,
+)
+from comet.utils.workers import workers
 
 streams = APIRouter()
 
@@ -51,474 +88,894 @@ async def stream_noconfig(request: Request, type: str, id: str):
     }
 
 
-@streams.get("/{b64config}/stream/{type}/{id}.json")
-async def stream(
-    request: Request,
-    b64config: str,
-    type: str,
-    id: str,
-    background_tasks: BackgroundTasks,
+async def get_cached_results(
+    services: list, name: str, season: int, episode: int, indexers_json: str
 ):
-    config = config_check(b64config)
-    if not config:
-        return {
-            "streams": [
-                {
-                    "name": "[⚠️] Comet",
-                    "description": "Invalid Comet config.",
-                    "url": "https://comet.fast",
-                }
-            ]
-        }
+    all_sorted_ranked_files = {}
+    trackers_found = (
+        set()
+    )  # we want to check that we have a cache for each of the user's trackers
+    stale = False  # expired results still served during CACHE_STALE_TTL
+    the_time = time.time()
+    cache_ttl = settings.CACHE_TTL
+
+    for debrid_service in services:
+        cached_results = await database.fetch_all(
+            """
+            SELECT info_hash, tracker, data, timestamp 
+            FROM cache 
+            WHERE debridService = :debrid_service 
+            AND name = :name 
+            AND ((:season IS NULL AND season IS NULL) OR season = :season)
+            AND ((:episode IS NULL AND episode IS NULL) OR episode = :episode)
+            AND tracker IN (SELECT value FROM json_each(:indexers))
+            AND timestamp + :cache_ttl >= :current_time
+            """,
+            {
+                "debrid_service": debrid_service,
+                "name": name,
+                "season": season,
+                "episode": episode,
+                "indexers": indexers_json,
+                "cache_ttl": cache_ttl + settings.CACHE_STALE_TTL,
+                "current_time": the_time,
+            },
+        )
+        for result in cached_results:
+            trackers_found.add(result["tracker"].lower())
+            all_sorted_ranked_files[result["info_hash"]] = orjson.loads(result["data"])
 
-    connector = aiohttp.TCPConnector(limit=0)
-    async with aiohttp.ClientSession(
-        connector=connector, raise_for_status=True
-    ) as session:
-        full_id = id
-        season = None
-        episode = None
-        if type == "series":
-            info = id.split(":")
-            id = info[0]
-            season = int(info[1])
-            episode = int(info[2])
+            if result["timestamp"] + cache_ttl < the_time:
+                stale = True
 
-        year = None
-        year_end = None
-        try:
-            kitsu = False
-            if id == "kitsu":
-                kitsu = True
-                get_metadata = await session.get(
-                    f"https://kitsu.io/api/edge/anime/{season}"
-                )
-                metadata = await get_metadata.json()
-                name = metadata["data"]["attributes"]["canonicalTitle"]
-                season = 1
-            else:
-                get_metadata = await session.get(
-                    f"https://v3.sg.media-imdb.com/suggestion/a/{id}.json"
-                )
-                metadata = await get_metadata.json()
-                element = metadata["d"][
-                    0
-                    if metadata["d"][0]["id"]
-                    not in ["/imdbpicks/summer-watch-guide", "/emmys"]
-                    else 1
-                ]
+    return all_sorted_ranked_files, trackers_found, stale
 
-                for element in metadata["d"]:
-                    if "/" not in element["id"]:
-                        break
 
-                name = element["l"]
-                year = element.get("y")
+async def scrape_and_rank(
+    session: aiohttp.ClientSession,
+    debrid,
+    config: dict,
+    type: str,
+    id: str,
+    full_id: str,
+    name: str,
+    log_name: str,
+    year: int,
+    year_end: int,
+    season: int,
+    episode: int,
+    kitsu: bool,
+):
+    aliases_task = None
+    if settings.TITLE_MATCH_CHECK and not kitsu:
+        # Fetched while the sources are being scraped so the title filter doesn't wait on Trakt
+        aliases_task = asyncio.create_task(
+            get_aliases(session, "movies" if type == "movie" else "shows", id)
+        )
 
-                if "yr" in element:
-                    year_end = int(element["yr"].split("-")[1])
-        except Exception as e:
-            logger.warning(f"Exception while getting metadata for {id}: {e}")
+    indexer_manager_type = settings.INDEXER_MANAGER_TYPE
 
-            return {
-                "streams": [
-                    {
-                        "name": "[⚠️] Comet",
-                        "description": f"Can't get metadata for {id}",
-                        "url": "https://comet.fast",
-                    }
-                ]
-            }
+    search_indexer = len(config["indexers"]) != 0
+    torrents = []
+    tasks = []
+    if indexer_manager_type and search_indexer:
+        logger.info(
+            f"Start of {indexer_manager_type} search for {log_name} with indexers {config['indexers']}"
+        )
 
-        name = translate(name)
-        log_name = name
+        search_terms = [name]
         if type == "series":
-            log_name = f"{name} S{season:02d}E{episode:02d}"
-
-        if (
-            settings.PROXY_DEBRID_STREAM
-            and settings.PROXY_DEBRID_STREAM_PASSWORD
-            == config["debridStreamProxyPassword"]
-            and config["debridApiKey"] == ""
-        ):
-            config["debridService"] = (
-                settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_SERVICE
+            search_terms = []
+            if not kitsu:
+                search_terms.append(f"{name} S{season:02d}E{episode:02d}")
+                search_terms.append(f"{name} s{season:02d}e{episode:02d}")
+            else:
+                search_terms.append(f"{name} {episode}")
+        tasks.append(
+            get_indexer_manager(
+                session, indexer_manager_type, config["indexers"], search_terms
             )
-            config["debridApiKey"] = settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_APIKEY
-
-        if config["debridApiKey"] == "":
-            services = ["realdebrid", "alldebrid", "premiumize", "torbox", "debridlink"]
-            debrid_emoji = "⬇️"
-        else:
-            services = [config["debridService"]]
-            debrid_emoji = "⚡"
+        )
+    else:
+        logger.info(
+            f"No indexer {'manager ' if not indexer_manager_type else ''}{'selected by user' if indexer_manager_type else 'defined'} for {log_name}"
+        )
 
-        results = []
-        if (
-            config["debridStreamProxyPassword"] != ""
-            and settings.PROXY_DEBRID_STREAM
-            and settings.PROXY_DEBRID_STREAM_PASSWORD
-            != config["debridStreamProxyPassword"]
-        ):
-            results.append(
-                {
-                    "name": "[⚠️] Comet",
-                    "description": "Debrid Stream Proxy Password incorrect.\nStreams will not be proxied.",
-                    "url": "https://comet.fast",
-                }
+    if settings.ZILEAN_URL:
+        tasks.append(get_zilean(session, name, log_name, season, episode))
+
+    if settings.SCRAPE_TORRENTIO:
+        tasks.append(get_torrentio(log_name, type, full_id))
+
+    if settings.SCRAPE_MEDIAFUSION:
+        tasks.append(get_mediafusion(log_name, type, full_id))
+
+    search_tasks = [asyncio.ensure_future(task) for task in tasks]
+    pending = set()
+    if settings.SCRAPE_DEADLINE and len(search_tasks) != 0:
+        _, pending = await asyncio.wait(search_tasks, timeout=settings.SCRAPE_DEADLINE)
+    else:
+        await asyncio.gather(*search_tasks)
+
+    for task in search_tasks:
+        if task in pending:
+            continue
+
+        for result in task.result():
+            torrents.append(result)
+
+    logger.info(
+        f"{len(torrents)} unique torrents found for {log_name}"
+        + (
+            " with "
+            + ", ".join(
+                part
+                for part in [
+                    indexer_manager_type,
+                    "Zilean" if settings.ZILEAN_URL else None,
+                    "Torrentio" if settings.SCRAPE_TORRENTIO else None,
+                    "MediaFusion" if settings.SCRAPE_MEDIAFUSION else None,
+                ]
+                if part
             )
+            if any(
+                [
+                    indexer_manager_type,
+                    settings.ZILEAN_URL,
+                    settings.SCRAPE_TORRENTIO,
+                    settings.SCRAPE_MEDIAFUSION,
+                ]
+            )
+            else ""
+        )
+    )
+
+    if len(pending) != 0:
+        logger.info(
+            f"{len(pending)} sources did not answer within {settings.SCRAPE_DEADLINE}s for {log_name}, their results will be cached once they finish"
+        )
 
-        indexers = config["indexers"].copy()
-        if settings.SCRAPE_TORRENTIO:
-            indexers.append("torrentio")
-        if settings.SCRAPE_MEDIAFUSION:
-            indexers.append("mediafusion")
-        if settings.ZILEAN_URL:
-            indexers.append("dmm")
-        indexers_json = orjson.dumps(indexers).decode("utf-8")
-
-        all_sorted_ranked_files = {}
-        trackers_found = (
-            set()
-        )  # we want to check that we have a cache for each of the user's trackers
-        the_time = time.time()
-        cache_ttl = settings.CACHE_TTL
-
-        for debrid_service in services:
-            cached_results = await database.fetch_all(
-                """
-                SELECT info_hash, tracker, data 
-                FROM cache 
-                WHERE debridService = :debrid_service 
-                AND name = :name 
-                AND ((:season IS NULL AND season IS NULL) OR season = :season)
-                AND ((:episode IS NULL AND episode IS NULL) OR episode = :episode)
-                AND tracker IN (SELECT value FROM json_each(:indexers))
-                AND timestamp + :cache_ttl >= :current_time
-                """,
+        late_scrape = asyncio.create_task(
+            merge_late_results(
+                pending,
                 {
-                    "debrid_service": debrid_service,
-                    "name": name,
-                    "season": season,
-                    "episode": episode,
-                    "indexers": indexers_json,
-                    "cache_ttl": cache_ttl,
-                    "current_time": the_time,
+                    torrent["InfoHash"].lower()
+                    for torrent in torrents
+                    if torrent.get("InfoHash")
                 },
+                aliases_task,
+                session,
+                debrid,
+                config,
+                type,
+                name,
+                log_name,
+                year,
+                year_end,
+                season,
+                episode,
+                kitsu,
             )
-            for result in cached_results:
-                trackers_found.add(result["tracker"].lower())
-                all_sorted_ranked_files[result["info_hash"]] = orjson.loads(
-                    result["data"]
-                )
+        )
+        background_scrapes.add(late_scrape)
+        late_scrape.add_done_callback(background_scrapes.discard)
+
+    return await rank_scraped_torrents(
+        torrents,
+        aliases_task,
+        session,
+        debrid,
+        config,
+        type,
+        name,
+        log_name,
+        year,
+        year_end,
+        season,
+        episode,
+        kitsu,
+    )
+
+
+async def rank_scraped_torrents(
+    torrents: list,
+    aliases_task: asyncio.Task,
+    session: aiohttp.ClientSession,
+    debrid,
+    config: dict,
+    type: str,
+    name: str,
+    log_name: str,
+    year: int,
+    year_end: int,
+    season: int,
+    episode: int,
+    kitsu: bool,
+):
+    # Returns (sorted_ranked_files, complete) - see get_torrent_hashes
+    if len(torrents) == 0:
+        return {}, True
+
+    if settings.TITLE_MATCH_CHECK:
+        aliases = await aliases_task if aliases_task is not None else {}
+
+        indexed_torrents = [(i, torrents[i]["Title"]) for i in range(len(torrents))]
+        remove_adult_content = settings.REMOVE_ADULT_CONTENT and config["removeTrash"]
+        filtered_torrents = await workers.map_chunks(
+            filter,
+            indexed_torrents,
+            name,
+            year,
+            year_end,
+            aliases,
+            remove_adult_content,
+        )
 
-        if len(all_sorted_ranked_files) != 0 and set(indexers).issubset(trackers_found):
-            debrid_extension = get_debrid_extension(
-                debrid_service, config["debridApiKey"]
-            )
-            balanced_hashes = get_balanced_hashes(all_sorted_ranked_files, config)
-
-            for resolution in balanced_hashes:
-                for hash in balanced_hashes[resolution]:
-                    data = all_sorted_ranked_files[hash]["data"]
-                    the_stream = {
-                        "name": f"[{debrid_extension}{debrid_emoji}] Comet {data['resolution']}",
-                        "description": format_title(data, config),
-                        "torrentTitle": (
-                            data["torrent_title"] if "torrent_title" in data else None
-                        ),
-                        "torrentSize": (
-                            data["torrent_size"] if "torrent_size" in data else None
-                        ),
-                        "behaviorHints": {
-                            "filename": data["raw_title"],
-                            "bingeGroup": "comet|" + hash,
-                        },
-                    }
+        index_less = 0
+        for filtered in filtered_torrents:
+            if not filtered[1]:
+                del torrents[filtered[0] - index_less]
+                index_less += 1
+                continue
 
-                    if config["debridApiKey"] != "":
-                        the_stream["url"] = (
-                            f"{request.url.scheme}://{request.url.netloc}/{b64config}/playback/{hash}/{data['index']}"
-                        )
-                    else:
-                        the_stream["infoHash"] = hash
-                        index = data["index"]
-                        the_stream["fileIdx"] = (
-                            1 if "|" in index else int(index)
-                        )  # 1 because for Premiumize it's impossible to get the file index
-                        the_stream["sources"] = trackers
+        logger.info(f"{len(torrents)} torrents passed title match check for {log_name}")
+
+        if len(torrents) == 0:
+            return {}, True
+
+    torrent_hashes, complete = await get_torrent_hashes(session, torrents, config)
+    index_less = 0
+    for hash in torrent_hashes:
+        if not hash[1]:
+            del torrents[hash[0] - index_less]
+            index_less += 1
+            continue
+
+        torrents[hash[0] - index_less]["InfoHash"] = hash[1]
+
+    logger.info(f"{len(torrents)} info hashes found for {log_name}")
+
+    if len(torrents) == 0:
+        return {}, complete
+
+    files = await debrid.get_files(
+        list({hash[1] for hash in torrent_hashes if hash[1] is not None}),
+        type,
+        season,
+        episode,
+        kitsu,
+    )
+
+    torrents_by_hash = {torrent["InfoHash"]: torrent for torrent in torrents}
+    ranked_files = set(
+        await workers.map_chunks(
+            rank_torrents,
+            [
+                (torrents_by_hash[hash]["Title"], hash)
+                for hash in files
+                if hash in torrents_by_hash
+            ],
+        )
+    )
 
-                    results.append(the_stream)
+    sorted_ranked_files = sort_torrents(ranked_files)
 
-            logger.info(
-                f"{len(all_sorted_ranked_files)} cached results found for {log_name}"
-            )
+    logger.info(
+        f"{len(sorted_ranked_files)} cached files found on {config['debridService']} for {log_name}"
+    )
 
-            return {"streams": results}
+    sorted_ranked_files = {
+        key: (value.model_dump() if isinstance(value, Torrent) else value)
+        for key, value in sorted_ranked_files.items()
+    }
+    for hash in sorted_ranked_files:  # needed for caching
+        sorted_ranked_files[hash]["data"]["title"] = files[hash]["title"]
+        sorted_ranked_files[hash]["data"]["torrent_title"] = torrents_by_hash[hash][
+            "Title"
+        ]
+        sorted_ranked_files[hash]["data"]["tracker"] = torrents_by_hash[hash]["Tracker"]
+        sorted_ranked_files[hash]["data"]["size"] = files[hash]["size"]
+        torrent_size = torrents_by_hash[hash]["Size"]
+        sorted_ranked_files[hash]["data"]["torrent_size"] = (
+            torrent_size if torrent_size else files[hash]["size"]
+        )
+        sorted_ranked_files[hash]["data"]["index"] = files[hash]["index"]
 
-        if config["debridApiKey"] == "":
-            return {
-                "streams": [
-                    {
-                        "name": "[⚠️] Comet",
-                        "description": "No cache found for Direct Torrenting.",
-                        "url": "https://comet.fast",
-                    }
-                ]
-            }
-        logger.info(f"No cache found for {log_name} with user configuration")
+    if settings.SEASON_PACK_FANOUT and type == "series" and not kitsu and complete:
+        fan_out = asyncio.create_task(
+            fan_out_season_packs(
+                config,
+                orjson.loads(orjson.dumps(sorted_ranked_files)),
+                {hash: torrents_by_hash[hash]["Size"] for hash in sorted_ranked_files},
+                name,
+                log_name,
+                season,
+                episode,
+            )
+        )
+        background_scrapes.add(fan_out)
+        fan_out.add_done_callback(background_scrapes.discard)
 
-        debrid = getDebrid(session, config, get_client_ip(request))
+    return sorted_ranked_files, complete
 
-        check_premium = await debrid.check_premium()
-        if not check_premium:
-            additional_info = ""
-            if config["debridService"] == "alldebrid":
-                additional_info = "\nCheck your email!"
 
-            return {
-                "streams": [
-                    {
-                        "name": "[⚠️] Comet",
-                        "description": f"Invalid {config['debridService']} account.{additional_info}",
-                        "url": "https://comet.fast",
-                    }
-                ]
-            }
+async def fan_out_season_packs(
+    config: dict,
+    sorted_ranked_files: dict,
+    torrent_sizes: dict,
+    name: str,
+    log_name: str,
+    season: int,
+    episode: int,
+):
+    # Season packs contain the other episodes too, their rows are cached right away
+    try:
+        debrid_service = config["debridService"]
+        hashes = list(sorted_ranked_files)
+        availability = {
+            hash: availability_cache.peek((debrid_service, hash), []) for hash in hashes
+        }
+        episodes = get_season_episodes(debrid_service, hashes, season)
+        episodes.discard(episode)
+        if len(episodes) == 0:
+            return
+
+        cached_rows = await database.fetch_all(
+            """
+            SELECT info_hash, episode 
+            FROM cache 
+            WHERE debridService = :debrid_service 
+            AND name = :name 
+            AND season = :season 
+            AND timestamp + :cache_ttl >= :current_time
+            """,
+            {
+                "debrid_service": debrid_service,
+                "name": name,
+                "season": season,
+                "cache_ttl": settings.CACHE_TTL,
+                "current_time": time.time(),
+            },
+        )
+        cached_rows = {(row["info_hash"], row["episode"]) for row in cached_rows}
+
+        fanned_out = 0
+        for pack_episode in sorted(episodes):
+            # Picked from the known file listings, nothing is sent upstream
+            files = select_files(availability, "series", season, pack_episode, False)
+
+            episode_files = {}
+            for hash, file in files.items():
+                if (hash, pack_episode) in cached_rows:
+                    continue
+
+                data = {
+                    **sorted_ranked_files[hash]["data"],
+                    "title": file["title"],
+                    "size": file["size"],
+                    "torrent_size": (
+                        torrent_sizes[hash] if torrent_sizes[hash] else file["size"]
+                    ),
+                    "index": (
+                        f"{season}|{pack_episode}"
+                        if debrid_service == "premiumize"
+                        else file["index"]
+                    ),
+                }
+                episode_files[hash] = {**sorted_ranked_files[hash], "data": data}
 
-        indexer_manager_type = settings.INDEXER_MANAGER_TYPE
+            if len(episode_files) != 0:
+                await add_torrent_to_cache(
+                    config, name, season, pack_episode, episode_files
+                )
+                fanned_out += 1
 
-        search_indexer = len(config["indexers"]) != 0
-        torrents = []
-        tasks = []
-        if indexer_manager_type and search_indexer:
+        if fanned_out != 0:
             logger.info(
-                f"Start of {indexer_manager_type} search for {log_name} with indexers {config['indexers']}"
+                f"Season pack results have been cached for {fanned_out} other episodes of {log_name}"
             )
+    except Exception as e:
+        logger.warning(f"Exception while caching season packs for {log_name}: {e}")
 
-            search_terms = [name]
-            if type == "series":
-                search_terms = []
-                if not kitsu:
-                    search_terms.append(f"{name} S{season:02d}E{episode:02d}")
-                    search_terms.append(f"{name} s{season:02d}e{episode:02d}")
-                else:
-                    search_terms.append(f"{name} {episode}")
-            tasks.extend(
-                get_indexer_manager(
-                    session, indexer_manager_type, config["indexers"], term
-                )
-                for term in search_terms
-            )
-        else:
-            logger.info(
-                f"No indexer {'manager ' if not indexer_manager_type else ''}{'selected by user' if indexer_manager_type else 'defined'} for {log_name}"
+
+background_scrapes = set()  # keeps a reference to the background merges and fan-outs
+
+
+async def merge_late_results(
+    pending: set,
+    known_hashes: set,
+    aliases_task: asyncio.Task,
+    session: aiohttp.ClientSession,
+    debrid,
+    config: dict,
+    type: str,
+    name: str,
+    log_name: str,
+    year: int,
+    year_end: int,
+    season: int,
+    episode: int,
+    kitsu: bool,
+):
+    try:
+        torrents = [
+            result
+            for results in await asyncio.gather(*pending)
+            for result in results
+            if not result.get("InfoHash")
+            or result["InfoHash"].lower() not in known_hashes
+        ]
+
+        sorted_ranked_files, complete = await rank_scraped_torrents(
+            torrents,
+            aliases_task,
+            session,
+            debrid,
+            config,
+            type,
+            name,
+            f"{log_name} (late sources)",
+            year,
+            year_end,
+            season,
+            episode,
+            kitsu,
+        )
+        if len(sorted_ranked_files) != 0 and complete:
+            await add_torrent_to_cache(
+                config, name, season, episode, sorted_ranked_files
             )
+    except Exception as e:
+        logger.warning(f"Exception while merging late results for {log_name}: {e}")
 
-        if settings.ZILEAN_URL:
-            tasks.append(get_zilean(session, name, log_name, season, episode))
 
-        if settings.SCRAPE_TORRENTIO:
-            tasks.append(get_torrentio(log_name, type, full_id))
+async def get_ranked_files(
+    flight_key: str,
+    indexers: list,
+    indexers_json: str,
+    session: aiohttp.ClientSession,
+    debrid,
+    config: dict,
+    type: str,
+    id: str,
+    full_id: str,
+    name: str,
+    log_name: str,
+    year: int,
+    year_end: int,
+    season: int,
+    episode: int,
+    kitsu: bool,
+):
+    # Returns (sorted_ranked_files, fresh, lease) - fresh results still have to be cached and the lease released afterwards
+    lease = False
+    if settings.STREAM_SINGLE_FLIGHT_CROSS_WORKER:
+        lease = await single_flight.acquire_lease(flight_key)
+        if not lease:
+            logger.info(f"Waiting for another worker to finish scraping {log_name}")
+            await single_flight.wait_lease(flight_key)
+
+            cached_files, trackers_found, _ = await get_cached_results(
+                [config["debridService"]], name, season, episode, indexers_json
+            )
+            if len(cached_files) != 0 and set(indexers).issubset(trackers_found):
+                return cached_files, False, False
 
-        if settings.SCRAPE_MEDIAFUSION:
-            tasks.append(get_mediafusion(log_name, type, full_id))
+            lease = await single_flight.acquire_lease(flight_key)
 
-        search_response = await asyncio.gather(*tasks)
-        for results in search_response:
-            for result in results:
-                torrents.append(result)
+    try:
+        sorted_ranked_files, complete = await scrape_and_rank(
+            session,
+            debrid,
+            config,
+            type,
+            id,
+            full_id,
+            name,
+            log_name,
+            year,
+            year_end,
+            season,
+            episode,
+            kitsu,
+        )
+    except Exception:
+        if lease:
+            await single_flight.release_lease(flight_key)
+        raise
+
+    if lease and (len(sorted_ranked_files) == 0 or not complete):
+        await single_flight.release_lease(flight_key)
+        lease = False
 
+    if not complete:
         logger.info(
-            f"{len(torrents)} unique torrents found for {log_name}"
-            + (
-                " with "
-                + ", ".join(
-                    part
-                    for part in [
-                        indexer_manager_type,
-                        "Zilean" if settings.ZILEAN_URL else None,
-                        "Torrentio" if settings.SCRAPE_TORRENTIO else None,
-                        "MediaFusion" if settings.SCRAPE_MEDIAFUSION else None,
-                    ]
-                    if part
-                )
-                if any(
-                    [
-                        indexer_manager_type,
-                        settings.ZILEAN_URL,
-                        settings.SCRAPE_TORRENTIO,
-                        settings.SCRAPE_MEDIAFUSION,
-                    ]
-                )
-                else ""
-            )
+            f"Results of {log_name} were cut short by the .torrent early stop, they won't be cached"
         )
 
-        if len(torrents) == 0:
-            return {"streams": []}
+    return sorted_ranked_files, complete, lease
 
-        if settings.TITLE_MATCH_CHECK:
-            aliases = await get_aliases(
-                session, "movies" if type == "movie" else "shows", id
-            )
 
-            indexed_torrents = [(i, torrents[i]["Title"]) for i in range(len(torrents))]
-            chunk_size = 50
-            chunks = [
-                indexed_torrents[i : i + chunk_size]
-                for i in range(0, len(indexed_torrents), chunk_size)
-            ]
+async def refresh_stale_results(
+    ranked_files_args: tuple,
+    config: dict,
+    name: str,
+    season: int,
+    episode: int,
+    indexers_json: str,
+    log_name: str,
+):
+    flight_key = ranked_files_args[0]
+    try:
+        (sorted_ranked_files, fresh, lease), leader = await single_flight.run(
+            flight_key, get_ranked_files, *ranked_files_args
+        )
+        if not leader or not fresh:
+            return
 
-            remove_adult_content = (
-                settings.REMOVE_ADULT_CONTENT and config["removeTrash"]
-            )
-            tasks = []
-            for chunk in chunks:
-                tasks.append(
-                    filter(chunk, name, year, year_end, aliases, remove_adult_content)
+        try:
+            if len(sorted_ranked_files) != 0:
+                await database.execute(
+                    """
+                    DELETE FROM cache 
+                    WHERE debridService = :debrid_service 
+                    AND name = :name 
+                    AND ((:season IS NULL AND season IS NULL) OR season = :season)
+                    AND ((:episode IS NULL AND episode IS NULL) OR episode = :episode)
+                    AND tracker IN (SELECT value FROM json_each(:indexers))
+                    AND timestamp + :cache_ttl < :current_time
+                    """,
+                    {
+                        "debrid_service": config["debridService"],
+                        "name": name,
+                        "season": season,
+                        "episode": episode,
+                        "indexers": indexers_json,
+                        "cache_ttl": settings.CACHE_TTL,
+                        "current_time": time.time(),
+                    },
+                )
+                await add_torrent_to_cache(
+                    config, name, season, episode, sorted_ranked_files
                 )
 
-            filtered_torrents = await asyncio.gather(*tasks)
-            index_less = 0
-            for result in filtered_torrents:
-                for filtered in result:
-                    if not filtered[1]:
-                        del torrents[filtered[0] - index_less]
-                        index_less += 1
-                        continue
+                logger.info(f"Stale results have been refreshed for {log_name}")
+        finally:
+            if lease:
+                await single_flight.release_lease(flight_key)
+    except Exception as e:
+        logger.warning(f"Exception while refreshing stale results for {log_name}: {e}")
 
-            logger.info(
-                f"{len(torrents)} torrents passed title match check for {log_name}"
+
+async def schedule_link_pregeneration(
+    request: Request, config: dict, sorted_ranked_files: dict, balanced_hashes: dict
+):
+    # Same debrid setup as playback() so the links are usable as they are
+    debrid = getDebrid(
+        clients.session,
+        config,
+        (
+            get_client_ip(request)
+            if (
+                not settings.PROXY_DEBRID_STREAM
+                or settings.PROXY_DEBRID_STREAM_PASSWORD
+                != config["debridStreamProxyPassword"]
             )
+            else ""
+        ),
+    )
+    files = [
+        (hash, str(sorted_ranked_files[hash]["data"]["index"]))
+        for resolution in balanced_hashes
+        for hash in balanced_hashes[resolution]
+    ]
+
+    await pregenerate_download_links(
+        debrid,
+        config["debridService"],
+        config["debridApiKey"],
+        files[: settings.PREGENERATE_LINKS],
+    )
+
+
+@streams.get("/{b64config}/stream/{type}/{id}.json")
+async def stream(
+    request: Request,
+    b64config: str,
+    type: str,
+    id: str,
+    background_tasks: BackgroundTasks,
+):
+    config = config_check(b64config)
+    if not config:
+        return {
+            "streams": [
+                {
+                    "name": "[⚠️] Comet",
+                    "description": "Invalid Comet config.",
+                    "url": "https://comet.fast",
+                }
+            ]
+        }
 
-            if len(torrents) == 0:
-                return {"streams": []}
+    session = clients.session
+    full_id = id
+    season = None
+    episode = None
+    if type == "series":
+        info = id.split(":")
+        id = info[0]
+        season = int(info[1])
+        episode = int(info[2])
+
+    kitsu = id == "kitsu"
+    media_id = f"kitsu:{season}" if kitsu else id
+    metadata = await get_metadata(session, media_id)
+    if metadata is None:
+        return {
+            "streams": [
+                {
+                    "name": "[⚠️] Comet",
+                    "description": f"Can't get metadata for {id}",
+                    "url": "https://comet.fast",
+                }
+            ]
+        }
 
-        tasks = []
-        for i in range(len(torrents)):
-            tasks.append(get_torrent_hash(session, (i, torrents[i])))
+    name = metadata["name"]
+    year = metadata["year"]
+    year_end = metadata["year_end"]
+    if kitsu:
+        season = 1
 
-        torrent_hashes = await asyncio.gather(*tasks)
-        index_less = 0
-        for hash in torrent_hashes:
-            if not hash[1]:
-                del torrents[hash[0] - index_less]
-                index_less += 1
-                continue
+    name = translate(name)
+    log_name = name
+    if type == "series":
+        log_name = f"{name} S{season:02d}E{episode:02d}"
 
-            torrents[hash[0] - index_less]["InfoHash"] = hash[1]
+    if (
+        settings.PROXY_DEBRID_STREAM
+        and settings.PROXY_DEBRID_STREAM_PASSWORD == config["debridStreamProxyPassword"]
+        and config["debridApiKey"] == ""
+    ):
+        config["debridService"] = settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_SERVICE
+        config["debridApiKey"] = settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_APIKEY
 
-        logger.info(f"{len(torrents)} info hashes found for {log_name}")
+    if config["debridApiKey"] == "":
+        services = ["realdebrid", "alldebrid", "premiumize", "torbox", "debridlink"]
+        debrid_emoji = "⬇️"
+    else:
+        services = [config["debridService"]]
+        debrid_emoji = "⚡"
 
-        if len(torrents) == 0:
-            return {"streams": []}
+    results = []
+    if (
+        config["debridStreamProxyPassword"] != ""
+        and settings.PROXY_DEBRID_STREAM
+        and settings.PROXY_DEBRID_STREAM_PASSWORD != config["debridStreamProxyPassword"]
+    ):
+        results.append(
+            {
+                "name": "[⚠️] Comet",
+                "description": "Debrid Stream Proxy Password incorrect.\nStreams will not be proxied.",
+                "url": "https://comet.fast",
+            }
+        )
 
-        files = await debrid.get_files(
-            list({hash[1] for hash in torrent_hashes if hash[1] is not None}),
-            type,
-            season,
-            episode,
-            kitsu,
+    indexers = config["indexers"].copy()
+    if settings.SCRAPE_TORRENTIO:
+        indexers.append("torrentio")
+    if settings.SCRAPE_MEDIAFUSION:
+        indexers.append("mediafusion")
+    if settings.ZILEAN_URL:
+        indexers.append("dmm")
+    indexers_json = orjson.dumps(indexers).decode("utf-8")
+
+    debrid = getDebrid(session, config, get_client_ip(request))
+
+    remove_adult_content = settings.REMOVE_ADULT_CONTENT and config["removeTrash"]
+    flight_key = f"{config['debridService']}|{name}|{season}|{episode}|{indexers_json}|{remove_adult_content}"
+    if settings.GET_TORRENT_EARLY_STOP_FACTOR > 0:
+        # The early stop depends on these, the results can't be shared beyond them
+        flight_key += f"|{config['maxResults']}|{','.join(config['resolutions'])}"
+    ranked_files_args = (
+        flight_key,
+        indexers,
+        indexers_json,
+        session,
+        debrid,
+        config,
+        type,
+        id,
+        full_id,
+        name,
+        log_name,
+        year,
+        year_end,
+        season,
+        episode,
+        kitsu,
+    )
+
+    all_sorted_ranked_files, trackers_found, stale = await get_cached_results(
+        services, name, season, episode, indexers_json
+    )
+
+    if len(all_sorted_ranked_files) != 0 and set(indexers).issubset(trackers_found):
+        debrid_extension = get_debrid_extension(
+            config["debridService"], config["debridApiKey"]
         )
+        balanced_hashes = get_balanced_hashes(all_sorted_ranked_files, config)
 
-        ranked_files = set()
-        torrents_by_hash = {torrent["InfoHash"]: torrent for torrent in torrents}
-        for hash in files:
-            try:
-                ranked_file = rtn.rank(
-                    torrents_by_hash[hash]["Title"],
-                    hash,
-                    remove_trash=False,  # user can choose if he wants to remove it
-                )
+        for resolution in balanced_hashes:
+            for hash in balanced_hashes[resolution]:
+                data = all_sorted_ranked_files[hash]["data"]
+                the_stream = {
+                    "name": f"[{debrid_extension}{debrid_emoji}] Comet {data['resolution']}",
+                    "description": format_title(data, config),
+                    "torrentTitle": (
+                        data["torrent_title"] if "torrent_title" in data else None
+                    ),
+                    "torrentSize": (
+                        data["torrent_size"] if "torrent_size" in data else None
+                    ),
+                    "behaviorHints": {
+                        "filename": data["raw_title"],
+                        "bingeGroup": "comet|" + hash,
+                    },
+                }
 
-                ranked_files.add(ranked_file)
-            except:
-                pass
+                if config["debridApiKey"] != "":
+                    the_stream["url"] = (
+                        f"{request.url.scheme}://{request.url.netloc}/{b64config}/playback/{hash}/{data['index']}"
+                    )
+                else:
+                    the_stream["infoHash"] = hash
+                    index = data["index"]
+                    the_stream["fileIdx"] = (
+                        1 if "|" in index else int(index)
+                    )  # 1 because for Premiumize it's impossible to get the file index
+                    the_stream["sources"] = trackers
+
+                results.append(the_stream)
+
+        if stale and config["debridApiKey"] != "":
+            if flight_key not in single_flight.calls:
+                background_tasks.add_task(
+                    refresh_stale_results,
+                    ranked_files_args,
+                    config,
+                    name,
+                    season,
+                    episode,
+                    indexers_json,
+                    log_name,
+                )
 
-        sorted_ranked_files = sort_torrents(ranked_files)
+        if settings.PREGENERATE_LINKS > 0 and config["debridApiKey"] != "":
+            background_tasks.add_task(
+                schedule_link_pregeneration,
+                request,
+                config,
+                all_sorted_ranked_files,
+                balanced_hashes,
+            )
 
-        len_sorted_ranked_files = len(sorted_ranked_files)
         logger.info(
-            f"{len_sorted_ranked_files} cached files found on {config['debridService']} for {log_name}"
+            f"{len(all_sorted_ranked_files)} {'stale ' if stale else ''}cached results found for {log_name}"
         )
 
-        if len_sorted_ranked_files == 0:
-            if config["debridApiKey"] == "realdebrid":
-                return {
-                    "streams": [
-                        {
-                            "name": "[⚠️] Comet",
-                            "description": "RealDebrid API is unstable!",
-                            "url": "https://comet.fast",
-                        }
-                    ]
+        return {"streams": results}
+
+    if config["debridApiKey"] == "":
+        return {
+            "streams": [
+                {
+                    "name": "[⚠️] Comet",
+                    "description": "No cache found for Direct Torrenting.",
+                    "url": "https://comet.fast",
                 }
+            ]
+        }
+    logger.info(f"No cache found for {log_name} with user configuration")
 
-            return {"streams": []}
+    check_premium = await debrid.check_premium()
+    if not check_premium:
+        additional_info = ""
+        if config["debridService"] == "alldebrid":
+            additional_info = "\nCheck your email!"
 
-        sorted_ranked_files = {
-            key: (value.model_dump() if isinstance(value, Torrent) else value)
-            for key, value in sorted_ranked_files.items()
-        }
-        for hash in sorted_ranked_files:  # needed for caching
-            sorted_ranked_files[hash]["data"]["title"] = files[hash]["title"]
-            sorted_ranked_files[hash]["data"]["torrent_title"] = torrents_by_hash[hash][
-                "Title"
-            ]
-            sorted_ranked_files[hash]["data"]["tracker"] = torrents_by_hash[hash][
-                "Tracker"
+        return {
+            "streams": [
+                {
+                    "name": "[⚠️] Comet",
+                    "description": f"Invalid {config['debridService']} account.{additional_info}",
+                    "url": "https://comet.fast",
+                }
             ]
-            sorted_ranked_files[hash]["data"]["size"] = files[hash]["size"]
-            torrent_size = torrents_by_hash[hash]["Size"]
-            sorted_ranked_files[hash]["data"]["torrent_size"] = (
-                torrent_size if torrent_size else files[hash]["size"]
-            )
-            sorted_ranked_files[hash]["data"]["index"] = files[hash]["index"]
+        }
+
+    if settings.STREAM_SINGLE_FLIGHT:
+        (sorted_ranked_files, fresh, lease), leader = await single_flight.run(
+            flight_key, get_ranked_files, *ranked_files_args
+        )
+        # Results are shared with the coalesced requests and formatting mutates
+        # them, every request works on its own copy
+        sorted_ranked_files = orjson.loads(orjson.dumps(sorted_ranked_files))
+    else:
+        (sorted_ranked_files, fresh, lease), leader = (
+            await get_ranked_files(*ranked_files_args),
+            True,
+        )
+
+    if len(sorted_ranked_files) == 0:
+        if config["debridApiKey"] == "realdebrid":
+            return {
+                "streams": [
+                    {
+                        "name": "[⚠️] Comet",
+                        "description": "RealDebrid API is unstable!",
+                        "url": "https://comet.fast",
+                    }
+                ]
+            }
+
+        return {"streams": []}
 
+    if leader and fresh:
         background_tasks.add_task(
             add_torrent_to_cache, config, name, season, episode, sorted_ranked_files
         )
+        if lease:
+            background_tasks.add_task(single_flight.release_lease, flight_key)
 
         logger.info(f"Results have been cached for {log_name}")
 
-        debrid_extension = get_debrid_extension(config["debridService"])
+    debrid_extension = get_debrid_extension(config["debridService"])
 
-        balanced_hashes = get_balanced_hashes(sorted_ranked_files, config)
+    balanced_hashes = get_balanced_hashes(sorted_ranked_files, config)
 
-        results = []
-        if (
-            config["debridStreamProxyPassword"] != ""
-            and settings.PROXY_DEBRID_STREAM
-            and settings.PROXY_DEBRID_STREAM_PASSWORD
-            != config["debridStreamProxyPassword"]
-        ):
+    results = []
+    if (
+        config["debridStreamProxyPassword"] != ""
+        and settings.PROXY_DEBRID_STREAM
+        and settings.PROXY_DEBRID_STREAM_PASSWORD != config["debridStreamProxyPassword"]
+    ):
+        results.append(
+            {
+                "name": "[⚠️] Comet",
+                "description": "Debrid Stream Proxy Password incorrect.\nStreams will not be proxied.",
+                "url": "https://comet.fast",
+            }
+        )
+
+    if settings.PREGENERATE_LINKS > 0:
+        background_tasks.add_task(
+            schedule_link_pregeneration,
+            request,
+            config,
+            sorted_ranked_files,
+            balanced_hashes,
+        )
+
+    for resolution in balanced_hashes:
+        for hash in balanced_hashes[resolution]:
+            data = sorted_ranked_files[hash]["data"]
             results.append(
                 {
-                    "name": "[⚠️] Comet",
-                    "description": "Debrid Stream Proxy Password incorrect.\nStreams will not be proxied.",
-                    "url": "https://comet.fast",
+                    "name": f"[{debrid_extension}⚡] Comet {data['resolution']}",
+                    "description": format_title(data, config),
+                    "torrentTitle": data["torrent_title"],
+                    "torrentSize": data["torrent_size"],
+                    "url": f"{request.url.scheme}://{request.url.netloc}/{b64config}/playback/{hash}/{data['index']}",
+                    "behaviorHints": {
+                        "filename": data["raw_title"],
+                        "bingeGroup": "comet|" + hash,
+                    },
                 }
             )
 
-        for resolution in balanced_hashes:
-            for hash in balanced_hashes[resolution]:
-                data = sorted_ranked_files[hash]["data"]
-                results.append(
-                    {
-                        "name": f"[{debrid_extension}⚡] Comet {data['resolution']}",
-                        "description": format_title(data, config),
-                        "torrentTitle": data["torrent_title"],
-                        "torrentSize": data["torrent_size"],
-                        "url": f"{request.url.scheme}://{request.url.netloc}/{b64config}/playback/{hash}/{data['index']}",
-                        "behaviorHints": {
-                            "filename": data["raw_title"],
-                            "bingeGroup": "comet|" + hash,
-                        },
-                    }
-                )
-
-        return {"streams": results}
+    return {"streams": results}
 
 
 @streams.head("/{b64config}/playback/{hash}/{index}")
@@ -539,7 +996,10 @@ async def active_connections(request: Request, password: str):
     if password != settings.DASHBOARD_ADMIN_PASSWORD:
         return "Invalid Password"
 
-    active_connections = await database.fetch_all("SELECT * FROM active_connections")
+    active_connections = [
+        {**connection, **bandwidth.get_stream(id)}
+        for id, connection in connections.connections.items()
+    ]
 
     return {
         "total_connections": len(active_connections),
@@ -547,6 +1007,35 @@ async def active_connections(request: Request, password: str):
     }
 
 
+@streams.get("/stats", response_class=CustomORJSONResponse)
+async def stats(request: Request, password: str):
+    if password != settings.DASHBOARD_ADMIN_PASSWORD:
+        return "Invalid Password"
+
+    return {
+        "single_flight": {
+            **single_flight.stats,
+            "in_flight": len(single_flight.calls),
+        },
+        "metadata": {**metadata_cache.stats(), **metadata_stats},
+        "aliases": {**aliases_cache.stats(), **aliases_stats},
+        "parse": parse_cache.stats(),
+        "indexer_manager": indexer_manager_stats,
+        "torrent_hashes": {**torrent_hash_cache.stats(), **torrent_hash_stats},
+        "debrid_availability": {**availability_cache.stats(), **availability_stats},
+        "download_links": {
+            **download_links_cache.stats(),
+            "pregeneration": pregeneration_stats,
+        },
+        "stream_cache": {
+            **chunk_cache.stats,
+            "blocks": len(chunk_cache.blocks),
+            "used": chunk_cache.used,
+            "budget": settings.PROXY_DEBRID_STREAM_CACHE_SIZE,
+        },
+    }
+
+
 @streams.get("/{b64config}/playback/{hash}/{index}")
 async def playback(request: Request, b64config: str, hash: str, index: str):
     config = config_check('eyJpbmRleGVycyI6WyJiaXRzZWFyY2giLCJ5dHMiLCJlenR2IiwidGhlcGlyYXRlYmF5IiwidGhlcmFyYmciXSwibWF4UmVzdWx0cyI6MCwibWF4UmVzdWx0c1BlclJlc29sdXRpb24iOjAsIm1heFNpemUiOjEwNzM3NDE4MjQwLCJyZXZlcnNlUmVzdWx0T3JkZXIiOmZhbHNlLCJyZW1vdmVUcmFzaCI6dHJ1ZSwicmVzdWx0Rm9ybWF0IjpbIkFsbCJdLCJyZXNvbHV0aW9ucyI6WyJBbGwiXSwibGFuZ3VhZ2VzIjpbIkFsbCJdLCJkZWJyaWRTZXJ2aWNlIjoiYWxsZGVicmlkIiwiZGVicmlkQXBpS2V5IjoiYndSTWR3eUY1ZGE2c20yb3EyN1giLCJkZWJyaWRTdHJlYW1Qcm94eVBhc3N3b3JkIjoicnJEREAwMDEifQ==')
@@ -564,138 +1053,161 @@ async def playback(request: Request, b64config: str, hash: str, index: str):
         config["debridService"] = settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_SERVICE
         config["debridApiKey"] = settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_APIKEY
 
-    async with aiohttp.ClientSession(raise_for_status=True) as session:
-        # Check for cached download link
-        cached_link = await database.fetch_one(
-            f"SELECT link, timestamp FROM download_links WHERE debrid_key = '{config['debridApiKey']}' AND hash = '{hash}' AND file_index = '{index}'"
-        )
-
-        current_time = time.time()
-        download_link = None
-        if cached_link:
-            link = cached_link["link"]
-            timestamp = cached_link["timestamp"]
+    session = clients.session
 
-            if current_time - timestamp < 3600:
-                download_link = link
-            else:
-                # Cache expired, remove old entry
-                await database.execute(
-                    f"DELETE FROM download_links WHERE debrid_key = '{config['debridApiKey']}' AND hash = '{hash}' AND file_index = '{index}'"
-                )
+    download_link = await get_download_link(
+        config["debridService"], config["debridApiKey"], hash, index
+    )
 
-        ip = get_client_ip(request)
+    ip = get_client_ip(request)
 
-        if not download_link:
-            debrid = getDebrid(
-                session,
-                config,
+    if not download_link:
+        debrid = getDebrid(
+            session,
+            config,
+            (
                 ip
                 if (
                     not settings.PROXY_DEBRID_STREAM
                     or settings.PROXY_DEBRID_STREAM_PASSWORD
                     != config["debridStreamProxyPassword"]
                 )
-                else "",
-            )
-            download_link = await debrid.generate_download_link(hash, index)
-            if not download_link:
-                return FileResponse("comet/assets/uncached.mp4")
+                else ""
+            ),
+        )
+        download_link = await debrid.generate_download_link(hash, index)
+        if not download_link:
+            return FileResponse("comet/assets/uncached.mp4")
 
-            # Cache the new download link
-            await database.execute(
-                f"INSERT {'OR IGNORE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO download_links (debrid_key, hash, file_index, link, timestamp) VALUES (:debrid_key, :hash, :file_index, :link, :timestamp){' ON CONFLICT DO NOTHING' if settings.DATABASE_TYPE == 'postgresql' else ''}",
-                {
-                    "debrid_key": config["debridApiKey"],
-                    "hash": hash,
-                    "file_index": index,
-                    "link": download_link,
-                    "timestamp": current_time,
-                },
-            )
+        await cache_download_link(
+            config["debridService"], config["debridApiKey"], hash, index, download_link
+        )
 
+    if (
+        settings.PROXY_DEBRID_STREAM
+        and settings.PROXY_DEBRID_STREAM_PASSWORD == config["debridStreamProxyPassword"]
+    ):
         if (
-            settings.PROXY_DEBRID_STREAM
-            and settings.PROXY_DEBRID_STREAM_PASSWORD
-            == config["debridStreamProxyPassword"]
+            settings.PROXY_DEBRID_STREAM_MAX_CONNECTIONS != -1
+            and connections.count(ip) >= settings.PROXY_DEBRID_STREAM_MAX_CONNECTIONS
         ):
-            if settings.PROXY_DEBRID_STREAM_MAX_CONNECTIONS != -1:
-                active_ip_connections = await database.fetch_all(
-                    "SELECT ip, COUNT(*) as connections FROM active_connections GROUP BY ip"
-                )
-                if any(
-                    connection["ip"] == ip
-                    and connection["connections"]
-                    >= settings.PROXY_DEBRID_STREAM_MAX_CONNECTIONS
-                    for connection in active_ip_connections
-                ):
-                    return FileResponse("comet/assets/proxylimit.mp4")
-
-            proxy = None
-
-            class Streamer:
-                def __init__(self, id: str):
-                    self.id = id
-
-                    self.client = httpx.AsyncClient(proxy=proxy)
-                    self.response = None
-
-                async def stream_content(self, headers: dict):
-                    async with self.client.stream(
-                        "GET", download_link, headers=headers
-                    ) as self.response:
-                        async for chunk in self.response.aiter_raw():
-                            yield chunk
-
-                async def close(self):
-                    await database.execute(
-                        f"DELETE FROM active_connections WHERE id = '{self.id}'"
-                    )
+            return FileResponse("comet/assets/proxylimit.mp4")
+
+        class Streamer:
+            def __init__(self, id: str, response: httpx.Response, chunks):
+                self.id = id
 
-                    if self.response is not None:
-                        await self.response.aclose()
-                    if self.client is not None:
-                        await self.client.aclose()
+                self.response = response
+                self.chunks = chunks
 
-            range_header = request.headers.get("range", "bytes=0-")
+            async def stream_content(self):
+                try:
+                    async for chunk in bandwidth.shape(self.id, ip, self.chunks):
+                        yield chunk
+                finally:
+                    await self.close()
 
-            response = await session.head(
-                download_link, headers={"Range": range_header}
+            async def close(self):
+                connections.remove(self.id)
+                if self.response is not None:
+                    await self.response.aclose()
+
+        async def open_stream(
+            range_header: str, proxy: str = None, retried: bool = False
+        ):
+            # The GET response headers are forwarded as is, no HEAD request is needed
+            client = clients.get_stream_client(proxy)
+            response = await client.send(
+                client.build_request(
+                    "GET", download_link, headers={"Range": range_header}
+                ),
+                stream=True,
             )
-            if response.status == 503 and config["debridService"] == "alldebrid":
-                proxy = (
-                    settings.DEBRID_PROXY_URL
+            if (
+                response.status_code == 503
+                and not retried
+                and config["debridService"] == "alldebrid"
+            ):
+                await response.aclose()
+
+                return await open_stream(
+                    range_header, settings.DEBRID_PROXY_URL, True
                 )  # proxy is not needed to proxy realdebrid stream
 
-                response = await session.head(
-                    download_link, headers={"Range": range_header}, proxy=proxy
-                )
+            return response
 
-            if response.status == 206:
-                id = str(uuid.uuid4())
-                await database.execute(
-                    f"INSERT  {'OR IGNORE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO active_connections (id, ip, content, timestamp) VALUES (:id, :ip, :content, :timestamp){' ON CONFLICT DO NOTHING' if settings.DATABASE_TYPE == 'postgresql' else ''}",
-                    {
-                        "id": id,
-                        "ip": ip,
-                        "content": str(response.url),
-                        "timestamp": current_time,
-                    },
+        range_header = request.headers.get("range", "bytes=0-")
+        media = (config["debridService"], hash, index)
+        segmented = settings.PROXY_DEBRID_STREAM_SEGMENTS > 1
+        requested = (
+            parse_range(range_header) if chunk_cache.enabled or segmented else None
+        )
+
+        total = None
+        if requested is not None and chunk_cache.enabled:
+            total = chunk_cache.sizes.get(media)
+
+        response = None
+        if total is None:
+            response = await open_stream(
+                first_segment_range(*requested)
+                if requested is not None and segmented
+                else range_header
+            )
+            if response.status_code != 206:
+                await response.aclose()
+
+                return FileResponse("comet/assets/uncached.mp4")
+
+            if requested is not None:
+                total = parse_content_range(response.headers.get("Content-Range", ""))
+                if total is not None and chunk_cache.enabled:
+                    chunk_cache.sizes.set(media, total)
+
+        if requested is not None and total is not None:
+            start, end = requested
+            if start >= total:
+                if response is not None:
+                    await response.aclose()
+
+                return Response(
+                    status_code=416, headers={"Content-Range": f"bytes */{total}"}
                 )
 
-                streamer = Streamer(id)
+            end = total - 1 if end is None else min(end, total - 1)
 
-                return StreamingResponse(
-                    streamer.stream_content({"Range": range_header}),
-                    status_code=206,
-                    headers={
-                        "Content-Range": response.headers["Content-Range"],
-                        "Content-Length": response.headers["Content-Length"],
-                        "Accept-Ranges": "bytes",
-                    },
-                    background=BackgroundTask(streamer.close),
+            if chunk_cache.enabled:
+                chunks = chunk_cache.serve(
+                    media, start, end, total, response, open_stream
                 )
+            else:
+                chunks = iter_range(open_stream, start, end, response)
 
-            return FileResponse("comet/assets/uncached.mp4")
+            headers = {
+                "Content-Range": f"bytes {start}-{end}/{total}",
+                "Content-Length": str(end - start + 1),
+            }
+        else:
+            chunks = iter_response(response)
+            headers = {
+                header: response.headers[header]
+                for header in ["Content-Range", "Content-Length"]
+                if header in response.headers
+            }
+
+        streamer = Streamer(
+            connections.add(
+                ip, str(response.url) if response is not None else download_link
+            ),
+            response,
+            chunks,
+        )
+
+        return StreamingResponse(
+            streamer.stream_content(),
+            status_code=206,
+            headers={**headers, "Accept-Ranges": "bytes"},
+            background=BackgroundTask(streamer.close),
+        )
 
-        return RedirectResponse(download_link, status_code=302)
+    return RedirectResponse(download_link, status_code=302)
@@ -0,0 +1,14 @@
+import asyncio
+
+from comet.utils.db import compact_cache, setup_database, teardown_database
+
+
+async def main():
+    # One-shot maintenance: python -m comet.compact (while Comet is stopped)
+    await setup_database()
+    await compact_cache()
+    await teardown_database()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
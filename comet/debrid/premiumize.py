@@ -1,9 +1,7 @@
 import aiohttp
-import asyncio
 
-from RTN import parse
-
-from comet.utils.general import is_video
+from comet.utils.availability import get_availability, select_files
+from comet.utils.general import is_video, cached_parse
 from comet.utils.logger import logger
 
 
@@ -38,11 +36,27 @@ class Premiumize:
             response = await self.session.get(
                 f"{self.api_url}/cache/check?apikey={self.debrid_api_key}&items[]={'&items[]='.join(chunk)}"
             )
-
             response = await response.json()
-            response["hashes"] = chunk
-
-            return response
+            if response["status"] != "success":
+                return None
+
+            availability = {}
+            for index, hash in enumerate(chunk):
+                files = []
+                filename = response["filename"][index]
+                filesize = response["filesize"][index]
+                if (
+                    response["response"][index]
+                    and filesize
+                    and "sample" not in filename.lower()
+                ):
+                    files.append(
+                        {"index": None, "title": filename, "size": int(filesize)}
+                    )
+
+                availability[hash] = files
+
+            return availability
         except Exception as e:
             logger.warning(
                 f"Exception while checking hash instant availability on Premiumize: {e}"
@@ -51,92 +65,19 @@ class Premiumize:
     async def get_files(
         self, torrent_hashes: list, type: str, season: str, episode: str, kitsu: bool
     ):
-        chunk_size = 100
-        chunks = [
-            torrent_hashes[i : i + chunk_size]
-            for i in range(0, len(torrent_hashes), chunk_size)
-        ]
-
-        tasks = []
-        for chunk in chunks:
-            tasks.append(self.get_instant(chunk))
-
-        responses = await asyncio.gather(*tasks)
-
-        availability = []
-        for response in responses:
-            if not response:
-                continue
-
-            availability.append(response)
-
-        files = {}
-
-        if type == "series":
-            for result in availability:
-                if result["status"] != "success":
-                    continue
-
-                responses = result["response"]
-                filenames = result["filename"]
-                filesizes = result["filesize"]
-                hashes = result["hashes"]
-                for index, response in enumerate(responses):
-                    if not response:
-                        continue
-
-                    if not filesizes[index]:
-                        continue
-
-                    filename = filenames[index]
-
-                    if "sample" in filename.lower():
-                        continue
-
-                    filename_parsed = parse(filename)
-                    if episode not in filename_parsed.episodes:
-                        continue
-
-                    if kitsu:
-                        if filename_parsed.seasons:
-                            continue
-                    else:
-                        if season not in filename_parsed.seasons:
-                            continue
-
-                    files[hashes[index]] = {
-                        "index": f"{season}|{episode}",
-                        "title": filename,
-                        "size": int(filesizes[index]),
-                    }
-        else:
-            for result in availability:
-                if result["status"] != "success":
-                    continue
-
-                responses = result["response"]
-                filenames = result["filename"]
-                filesizes = result["filesize"]
-                hashes = result["hashes"]
-                for index, response in enumerate(responses):
-                    if response is False:
-                        continue
-
-                    if not filesizes[index]:
-                        continue
-
-                    filename = filenames[index]
-
-                    if "sample" in filename.lower():
-                        continue
-
-                    files[hashes[index]] = {
-                        "index": 0,
-                        "title": filename,
-                        "size": int(filesizes[index]),
-                    }
-
-        return files
+        availability = await get_availability(
+            "premiumize", torrent_hashes, 100, self.get_instant
+        )
+
+        return {
+            hash: {
+                **file,
+                "index": f"{season}|{episode}" if type == "series" else 0,
+            }
+            for hash, file in select_files(
+                availability, type, season, episode, kitsu
+            ).items()
+        }
 
     async def generate_download_link(self, hash: str, index: str):
         try:
@@ -162,7 +103,7 @@ class Premiumize:
                     continue
 
                 if season is not None:
-                    filename_parsed = parse(filename)
+                    filename_parsed = cached_parse(filename)
                     if (
                         season in filename_parsed.seasons
                         and episode in filename_parsed.episodes
@@ -1,8 +1,6 @@
 import aiohttp
-import asyncio
-
-from RTN import parse
 
+from comet.utils.availability import get_availability, select_files
 from comet.utils.general import is_video
 from comet.utils.logger import logger
 from comet.utils.models import settings
@@ -10,8 +8,8 @@ from comet.utils.models import settings
 
 class RealDebrid:
     def __init__(self, session: aiohttp.ClientSession, debrid_api_key: str, ip: str):
-        session.headers["Authorization"] = f"Bearer {debrid_api_key}"
         self.session = session
+        self.headers = {"Authorization": f"Bearer {debrid_api_key}"}
         self.ip = ip
         self.proxy = None
 
@@ -19,7 +17,9 @@ class RealDebrid:
 
     async def check_premium(self):
         try:
-            check_premium = await self.session.get(f"{self.api_url}/user")
+            check_premium = await self.session.get(
+                f"{self.api_url}/user", headers=self.headers
+            )
             check_premium = await check_premium.text()
             if '"type": "premium"' in check_premium:
                 return True
@@ -33,97 +33,53 @@ class RealDebrid:
     async def get_instant(self, chunk: list):
         try:
             response = await self.session.get(
-                f"{self.api_url}/torrents/instantAvailability/{'/'.join(chunk)}"
-            )
-            return await response.json()
-        except Exception as e:
-            logger.warning(
-                f"Exception while checking hash instant availability on Real-Debrid: {e}"
+                f"{self.api_url}/torrents/instantAvailability/{'/'.join(chunk)}",
+                headers=self.headers,
             )
+            response = await response.json()
 
-    async def get_files(
-        self, torrent_hashes: list, type: str, season: str, episode: str, kitsu: bool
-    ):
-        chunk_size = 100
-        chunks = [
-            torrent_hashes[i : i + chunk_size]
-            for i in range(0, len(torrent_hashes), chunk_size)
-        ]
-
-        tasks = []
-        for chunk in chunks:
-            tasks.append(self.get_instant(chunk))
-
-        responses = await asyncio.gather(*tasks)
-
-        availability = {}
-        for response in responses:
-            if response is not None:
-                availability.update(response)
-
-        files = {}
-
-        if type == "series":
-            for hash, details in availability.items():
-                if "rd" not in details:
-                    continue
-
-                for variants in details["rd"]:
-                    for index, file in variants.items():
-                        filename = file["filename"]
+            availability = {}
+            for hash, details in response.items():
+                files = {}
+                if "rd" in details:
+                    for variants in details["rd"]:
+                        for index, file in variants.items():
+                            filename = file["filename"]
 
-                        if not is_video(filename):
-                            continue
-
-                        if "sample" in filename.lower():
-                            continue
-
-                        filename_parsed = parse(filename)
-                        if episode not in filename_parsed.episodes:
-                            continue
-
-                        if kitsu:
-                            if filename_parsed.seasons:
-                                continue
-                        else:
-                            if season not in filename_parsed.seasons:
+                            if not is_video(filename):
                                 continue
 
-                        files[hash] = {
-                            "index": index,
-                            "title": filename,
-                            "size": file["filesize"],
-                        }
-
-                        break
-        else:
-            for hash, details in availability.items():
-                if "rd" not in details:
-                    continue
-
-                for variants in details["rd"]:
-                    for index, file in variants.items():
-                        filename = file["filename"]
+                            if "sample" in filename.lower():
+                                continue
 
-                        if not is_video(filename):
-                            continue
+                            files[index] = {
+                                "index": index,
+                                "title": filename,
+                                "size": file["filesize"],
+                            }
 
-                        if "sample" in filename.lower():
-                            continue
+                availability[hash] = list(files.values())
 
-                        files[hash] = {
-                            "index": index,
-                            "title": filename,
-                            "size": file["filesize"],
-                        }
+            return availability
+        except Exception as e:
+            logger.warning(
+                f"Exception while checking hash instant availability on Real-Debrid: {e}"
+            )
 
-                        break
+    async def get_files(
+        self, torrent_hashes: list, type: str, season: str, episode: str, kitsu: bool
+    ):
+        availability = await get_availability(
+            "realdebrid", torrent_hashes, 100, self.get_instant
+        )
 
-        return files
+        return select_files(availability, type, season, episode, kitsu)
 
     async def generate_download_link(self, hash: str, index: str):
         try:
-            check_blacklisted = await self.session.get("https://real-debrid.com/vpn")
+            check_blacklisted = await self.session.get(
+                "https://real-debrid.com/vpn", headers=self.headers
+            )
             check_blacklisted = await check_blacklisted.text()
             if (
                 "Your ISP or VPN provider IP address is currently blocked on our website"
@@ -143,11 +99,12 @@ class RealDebrid:
                 f"{self.api_url}/torrents/addMagnet",
                 data={"magnet": f"magnet:?xt=urn:btih:{hash}", "ip": self.ip},
                 proxy=self.proxy,
+                headers=self.headers,
             )
             add_magnet = await add_magnet.json()
 
             get_magnet_info = await self.session.get(
-                add_magnet["uri"], proxy=self.proxy
+                add_magnet["uri"], proxy=self.proxy, headers=self.headers
             )
             get_magnet_info = await get_magnet_info.json()
 
@@ -162,10 +119,11 @@ class RealDebrid:
                     "ip": self.ip,
                 },
                 proxy=self.proxy,
+                headers=self.headers,
             )
 
             get_magnet_info = await self.session.get(
-                add_magnet["uri"], proxy=self.proxy
+                add_magnet["uri"], proxy=self.proxy, headers=self.headers
             )
             get_magnet_info = await get_magnet_info.json()
 
@@ -182,6 +140,7 @@ class RealDebrid:
                 f"{self.api_url}/unrestrict/link",
                 data={"link": get_magnet_info["links"][index - 1], "ip": self.ip},
                 proxy=self.proxy,
+                headers=self.headers,
             )
             unrestrict_link = await unrestrict_link.json()
 
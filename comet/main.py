@@ -1,3 +1,4 @@
+import asyncio
 import contextlib
 import signal
 import sys
@@ -15,9 +16,21 @@ from starlette.requests import Request
 
 from comet.api.core import main
 from comet.api.stream import streams
+from comet.utils.chunk_cache import chunk_cache
+from comet.utils.clients import clients
+from comet.utils.connections import connections
 from comet.utils.db import setup_database, teardown_database
+from comet.utils.download_links import purge_download_links_periodically
+from comet.utils.general import (
+    load_parse_cache,
+    persist_parse_cache,
+    persist_parse_cache_periodically,
+    refresh_prowlarr_indexers,
+    refresh_prowlarr_indexers_periodically,
+)
 from comet.utils.logger import logger
 from comet.utils.models import settings
+from comet.utils.workers import workers
 
 
 class LoguruMiddleware(BaseHTTPMiddleware):
@@ -40,7 +53,38 @@ class LoguruMiddleware(BaseHTTPMiddleware):
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await setup_database()
+    await clients.start()
+    await load_parse_cache()
+    workers.start()
+    if chunk_cache.enabled:
+        chunk_cache.start()
+    parse_cache_task = None
+    if settings.PARSE_CACHE_PERSIST:
+        parse_cache_task = asyncio.create_task(persist_parse_cache_periodically())
+    download_links_task = asyncio.create_task(purge_download_links_periodically())
+    connections_task = None
+    if settings.ACTIVE_CONNECTIONS_SNAPSHOT_INTERVAL > 0:
+        connections_task = asyncio.create_task(connections.snapshot_periodically())
+    prowlarr_indexers_task = None
+    if settings.INDEXER_MANAGER_TYPE == "prowlarr":
+        await refresh_prowlarr_indexers(clients.session)
+        if settings.INDEXER_MANAGER_REFRESH_INTERVAL > 0:
+            prowlarr_indexers_task = asyncio.create_task(
+                refresh_prowlarr_indexers_periodically(clients.session)
+            )
     yield
+    download_links_task.cancel()
+    if connections_task is not None:
+        connections_task.cancel()
+    if prowlarr_indexers_task is not None:
+        prowlarr_indexers_task.cancel()
+    if parse_cache_task is not None:
+        parse_cache_task.cancel()
+        await persist_parse_cache()
+    workers.close()
+    if chunk_cache.enabled:
+        chunk_cache.close()
+    await clients.close()
     await teardown_database()
 
 
@@ -157,6 +201,10 @@ def start_log():
         f"Debrid Stream Proxy: {bool(settings.PROXY_DEBRID_STREAM)} - Password: {settings.PROXY_DEBRID_STREAM_PASSWORD} - Max Connections: {settings.PROXY_DEBRID_STREAM_MAX_CONNECTIONS} - Default Debrid Service: {settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_SERVICE} - Default Debrid API Key: {settings.PROXY_DEBRID_STREAM_DEBRID_DEFAULT_APIKEY}",
     )
     logger.log("COMET", f"Title Match Check: {bool(settings.TITLE_MATCH_CHECK)}")
+    logger.log(
+        "COMET",
+        f"Parse Executor: {settings.PARSE_EXECUTOR} - Workers: {settings.PARSE_EXECUTOR_WORKERS} - Chunk Size: {settings.PARSE_CHUNK_SIZE} - Inline Threshold: {settings.PARSE_INLINE_THRESHOLD}",
+    )
     logger.log("COMET", f"Remove Adult Content: {bool(settings.REMOVE_ADULT_CONTENT)}")
     logger.log("COMET", f"Custom Header HTML: {bool(settings.CUSTOM_HEADER_HTML)}")
 
@@ -0,0 +1,80 @@
+import asyncio
+
+from comet.utils.cache import LRUCache
+from comet.utils.general import cached_parse
+from comet.utils.models import settings
+
+# (debrid service, info hash) -> video files of the torrent, empty when it isn't cached
+availability_cache = LRUCache(
+    settings.DEBRID_AVAILABILITY_CACHE_SIZE, settings.DEBRID_AVAILABILITY_CACHE_TTL
+)
+availability_stats = {"upstream_hashes": 0}
+
+
+async def get_availability(
+    debrid_service: str, torrent_hashes: list, chunk_size: int, get_instant
+):
+    # get_instant(chunk) returns {hash: files} or None if the check failed
+    availability = {}
+    unknown_hashes = []
+    for hash in torrent_hashes:
+        files = availability_cache.get((debrid_service, hash))
+        if files is None:
+            unknown_hashes.append(hash)
+            continue
+
+        availability[hash] = files
+
+    chunks = [
+        unknown_hashes[i : i + chunk_size]
+        for i in range(0, len(unknown_hashes), chunk_size)
+    ]
+    availability_stats["upstream_hashes"] += len(unknown_hashes)
+    responses = await asyncio.gather(*[get_instant(chunk) for chunk in chunks])
+
+    for chunk, response in zip(chunks, responses):
+        if response is None:
+            continue
+
+        response = {hash.lower(): files for hash, files in response.items()}
+        for hash in chunk:
+            files = response.get(hash.lower(), [])
+            availability_cache.set((debrid_service, hash), files)
+            availability[hash] = files
+
+    return availability
+
+
+def select_files(availability: dict, type: str, season: int, episode: int, kitsu: bool):
+    files = {}
+    for hash, torrent_files in availability.items():
+        for file in torrent_files:
+            if type == "series":
+                filename_parsed = cached_parse(file["title"])
+                if episode not in filename_parsed.episodes:
+                    continue
+
+                if kitsu:
+                    if filename_parsed.seasons:
+                        continue
+                else:
+                    if season not in filename_parsed.seasons:
+                        continue
+
+            files[hash] = file
+
+            break
+
+    return files
+
+
+def get_season_episodes(debrid_service: str, torrent_hashes: list, season: int):
+    # Episodes of the season found in the known file listings of the torrents
+    episodes = set()
+    for hash in torrent_hashes:
+        for file in availability_cache.peek((debrid_service, hash), []):
+            filename_parsed = cached_parse(file["title"])
+            if season in filename_parsed.seasons:
+                episodes.update(filename_parsed.episodes)
+
+    return episodes
@@ -0,0 +1,104 @@
+import asyncio
+import time
+
+from comet.utils.models import settings
+
+
+class TokenBucket:
+    def __init__(self, rate: int):
+        self.rate = rate  # bytes per second, also the burst size
+        self.tokens = rate
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()  # waiters are served in order, streams share fairly
+
+    async def consume(self, amount: int):
+        async with self.lock:
+            current_time = time.monotonic()
+            self.tokens = min(
+                self.rate, self.tokens + (current_time - self.updated) * self.rate
+            )
+            self.updated = current_time
+
+            self.tokens -= amount
+            if self.tokens < 0:
+                await asyncio.sleep(-self.tokens / self.rate)
+
+
+class Throughput:
+    window = 5  # seconds
+
+    def __init__(self):
+        self.bytes_sent = 0
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.rate = 0
+
+    def add(self, amount: int):
+        self.bytes_sent += amount
+        self.window_bytes += amount
+
+        current_time = time.monotonic()
+        if current_time - self.window_start >= self.window:
+            self.rate = self.window_bytes / (current_time - self.window_start)
+            self.window_start = current_time
+            self.window_bytes = 0
+
+    def current(self):
+        if time.monotonic() - self.window_start >= 2 * self.window:
+            return 0  # stalled, nothing was sent during the last window
+
+        return round(self.rate)
+
+
+class BandwidthShaper:
+    def __init__(self):
+        self.global_bucket = None
+        if settings.PROXY_DEBRID_STREAM_MAX_BANDWIDTH > 0:
+            self.global_bucket = TokenBucket(settings.PROXY_DEBRID_STREAM_MAX_BANDWIDTH)
+
+        self.ip_buckets = {}  # ip -> [bucket, streams]
+        self.streams = {}  # active connection id -> Throughput
+
+    async def shape(self, id: str, ip: str, chunks):
+        buckets = []
+        if settings.PROXY_DEBRID_STREAM_MAX_BANDWIDTH_PER_IP > 0:
+            if ip not in self.ip_buckets:
+                self.ip_buckets[ip] = [
+                    TokenBucket(settings.PROXY_DEBRID_STREAM_MAX_BANDWIDTH_PER_IP),
+                    0,
+                ]
+            self.ip_buckets[ip][1] += 1
+            buckets.append(self.ip_buckets[ip][0])
+
+        if self.global_bucket is not None:
+            buckets.append(self.global_bucket)
+
+        throughput = Throughput()
+        self.streams[id] = throughput
+        try:
+            async for chunk in chunks:
+                for bucket in buckets:
+                    await bucket.consume(len(chunk))
+
+                yield chunk
+                throughput.add(len(chunk))
+        finally:
+            del self.streams[id]
+
+            if ip in self.ip_buckets:
+                self.ip_buckets[ip][1] -= 1
+                if self.ip_buckets[ip][1] == 0:
+                    del self.ip_buckets[ip]
+
+    def get_stream(self, id: str):
+        throughput = self.streams.get(id)
+        if throughput is None:
+            return {}
+
+        return {
+            "bytes_sent": throughput.bytes_sent,
+            "throughput": throughput.current(),
+        }
+
+
+bandwidth = BandwidthShaper()
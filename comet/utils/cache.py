@@ -0,0 +1,64 @@
+import time
+
+from collections import OrderedDict
+
+
+class LRUCache:
+    def __init__(self, maxsize: int, ttl: int = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+
+        value, expires = entry
+        if expires is not None and expires < time.time():
+            del self.data[key]
+            self.misses += 1
+            return default
+
+        self.data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key, default=None):
+        # Like get, without touching the LRU order or the hit counters
+        entry = self.data.get(key)
+        if entry is None or (entry[1] is not None and entry[1] < time.time()):
+            return default
+
+        return entry[0]
+
+    def set(self, key, value, ttl: int = None):
+        if self.maxsize <= 0:
+            return
+
+        ttl = ttl if ttl is not None else self.ttl
+        self.data[key] = (value, time.time() + ttl if ttl is not None else None)
+        self.data.move_to_end(key)
+
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def pop(self, key):
+        entry = self.data.pop(key, None)
+        return entry[0] if entry is not None else None
+
+    def __len__(self):
+        return len(self.data)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0,
+        }
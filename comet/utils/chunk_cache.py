@@ -0,0 +1,223 @@
+import asyncio
+import hashlib
+import os
+import shutil
+
+from collections import OrderedDict
+
+from comet.utils.cache import LRUCache
+from comet.utils.logger import logger
+from comet.utils.models import settings
+from comet.utils.streaming import iter_range
+
+
+def read_block(path: str):
+    with open(path, "rb") as file:
+        return file.read()
+
+
+def process_exists(pid: int):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+
+    return True
+
+
+def write_block(path: str, data: bytes):
+    with open(f"{path}.tmp", "wb") as file:
+        file.write(data)
+
+    os.replace(f"{path}.tmp", path)
+
+
+class ChunkCache:
+    def __init__(self):
+        self.enabled = settings.PROXY_DEBRID_STREAM_CACHE_SIZE > 0
+        self.block_size = settings.PROXY_DEBRID_STREAM_CACHE_BLOCK_SIZE
+        self.path = None
+
+        self.blocks = OrderedDict()  # (media, block number) -> length, in LRU order
+        self.writing = set()
+        self.used = 0
+        self.sizes = LRUCache(10000)  # media -> file size
+        self.stats = {
+            "block_hits": 0,
+            "blocks_fetched": 0,
+            "evictions": 0,
+            "bytes_from_disk": 0,
+            "bytes_from_upstream": 0,
+        }
+
+    def start(self):
+        # Every worker has its own directory, the budget applies to each of them -
+        # directories left behind by workers that didn't exit cleanly are removed
+        os.makedirs(settings.PROXY_DEBRID_STREAM_CACHE_PATH, exist_ok=True)
+        for entry in os.listdir(settings.PROXY_DEBRID_STREAM_CACHE_PATH):
+            if entry.isdigit() and not process_exists(int(entry)):
+                shutil.rmtree(
+                    os.path.join(settings.PROXY_DEBRID_STREAM_CACHE_PATH, entry),
+                    ignore_errors=True,
+                )
+
+        self.path = os.path.join(
+            settings.PROXY_DEBRID_STREAM_CACHE_PATH, str(os.getpid())
+        )
+        shutil.rmtree(self.path, ignore_errors=True)
+        os.makedirs(self.path)
+
+    def close(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def block_path(self, key: tuple):
+        return os.path.join(self.path, hashlib.sha1(repr(key).encode()).hexdigest())
+
+    def discard(self, key: tuple):
+        length = self.blocks.pop(key, None)
+        if length is None:
+            return
+
+        self.used -= length
+        try:
+            os.remove(self.block_path(key))
+        except OSError:
+            pass
+
+    async def read(self, key: tuple):
+        if key not in self.blocks:
+            return None
+
+        self.blocks.move_to_end(key)
+        try:
+            return await asyncio.to_thread(read_block, self.block_path(key))
+        except OSError:
+            self.discard(key)
+            return None
+
+    async def write(self, key: tuple, data: bytes):
+        if key in self.blocks or key in self.writing:
+            return
+
+        self.writing.add(key)
+        try:
+            await asyncio.to_thread(write_block, self.block_path(key), data)
+        except OSError as e:
+            logger.warning(f"Exception while caching stream block: {e}")
+            return
+        finally:
+            self.writing.discard(key)
+
+        self.blocks[key] = len(data)
+        self.used += len(data)
+        self.stats["blocks_fetched"] += 1
+
+        while self.used > settings.PROXY_DEBRID_STREAM_CACHE_SIZE:
+            self.discard(next(iter(self.blocks)))
+            self.stats["evictions"] += 1
+
+    async def relay(
+        self,
+        media: tuple,
+        chunks,
+        offset: int,
+        position: int,
+        end: int,
+        total: int,
+    ):
+        # offset is the file position of the first upstream chunk, complete blocks
+        # are cached while the requested part is relayed
+        buffer_start = offset
+        buffer = bytearray()
+        try:
+            async for chunk in chunks:
+                chunk_start = buffer_start + len(buffer)
+                buffer += chunk
+                self.stats["bytes_from_upstream"] += len(chunk)
+
+                piece = chunk[max(position - chunk_start, 0) : end - chunk_start + 1]
+                if piece:
+                    position += len(piece)
+                    yield piece
+
+                while buffer_start < total:
+                    boundary = min(
+                        (buffer_start // self.block_size + 1) * self.block_size, total
+                    )
+                    if buffer_start + len(buffer) < boundary:
+                        break
+
+                    # Partial blocks at the start of an unaligned range are skipped
+                    if buffer_start % self.block_size == 0:
+                        await self.write(
+                            (media, buffer_start // self.block_size),
+                            bytes(buffer[: boundary - buffer_start]),
+                        )
+
+                    del buffer[: boundary - buffer_start]
+                    buffer_start = boundary
+
+                if position > end:
+                    return
+        finally:
+            await chunks.aclose()
+
+    async def serve(
+        self,
+        media: tuple,
+        start: int,
+        end: int,
+        total: int,
+        response,
+        open_upstream,
+    ):
+        # Cached blocks are read from disk, each run of missing blocks is fetched
+        # upstream - response, if given, is already opened at start
+        position = start
+        while position <= end:
+            if response is None:
+                block = position // self.block_size
+                block_start = block * self.block_size
+                data = await self.read((media, block))
+                if data is not None:
+                    piece = data[position - block_start : end - block_start + 1]
+                    self.stats["block_hits"] += 1
+                    self.stats["bytes_from_disk"] += len(piece)
+                    position += len(piece)
+                    yield piece
+                    continue
+
+                last = block
+                while (
+                    last < end // self.block_size
+                    and (media, last + 1) not in self.blocks
+                ):
+                    last += 1
+
+                offset = block_start
+                chunks = iter_range(
+                    open_upstream,
+                    block_start,
+                    min((last + 1) * self.block_size, total) - 1,
+                )
+            else:
+                offset = start
+                chunks = iter_range(open_upstream, start, end, response)
+                response = None
+
+            relayed = position
+            pieces = self.relay(media, chunks, offset, position, end, total)
+            try:
+                async for piece in pieces:
+                    position += len(piece)
+                    yield piece
+            finally:
+                await pieces.aclose()
+
+            if position == relayed:
+                return  # the upstream sent nothing, don't ask again
+
+
+chunk_cache = ChunkCache()
@@ -0,0 +1,64 @@
+import aiohttp
+import httpx
+import importlib.util
+
+from curl_cffi.requests import AsyncSession
+from comet.utils.logger import logger
+from comet.utils.models import settings
+
+
+class ClientManager:
+    def __init__(self):
+        self.session = None
+        self.scrape_session = None
+        self.stream_clients = {}
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(
+            limit=settings.HTTP_MAX_CONNECTIONS,
+            limit_per_host=settings.HTTP_MAX_CONNECTIONS_PER_HOST,
+            keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+            ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+        )
+        self.session = aiohttp.ClientSession(connector=connector, raise_for_status=True)
+        # Torrentio and MediaFusion are scraped with curl_cffi
+        self.scrape_session = AsyncSession(timeout=settings.SCRAPE_TIMEOUT)
+
+    def get_stream_client(self, proxy: str = None):
+        # One pooled client per proxy since httpx proxies are bound to the client
+        if proxy not in self.stream_clients:
+            http2 = settings.PROXY_DEBRID_STREAM_HTTP2
+            if http2 and importlib.util.find_spec("h2") is None:
+                logger.warning(
+                    "PROXY_DEBRID_STREAM_HTTP2 needs the h2 package, using HTTP/1.1 instead"
+                )
+                http2 = False
+
+            self.stream_clients[proxy] = httpx.AsyncClient(
+                proxy=proxy,
+                http2=http2,
+                limits=httpx.Limits(
+                    max_connections=settings.HTTP_MAX_CONNECTIONS or None,
+                    max_keepalive_connections=settings.HTTP_MAX_CONNECTIONS or None,
+                    keepalive_expiry=settings.HTTP_KEEPALIVE_TIMEOUT,
+                ),
+            )
+
+        return self.stream_clients[proxy]
+
+    async def close(self):
+        try:
+            if self.session is not None:
+                await self.session.close()
+
+            if self.scrape_session is not None:
+                await self.scrape_session.close()
+
+            for client in self.stream_clients.values():
+                await client.aclose()
+            self.stream_clients.clear()
+        except Exception as e:
+            logger.error(f"Error closing HTTP clients: {e}")
+
+
+clients = ClientManager()
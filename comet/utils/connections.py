@@ -0,0 +1,69 @@
+import asyncio
+import time
+import uuid
+
+from comet.utils.logger import logger
+from comet.utils.models import database, settings
+
+
+class ConnectionTracker:
+    def __init__(self):
+        self.connections = {}  # id -> {"id", "ip", "content", "timestamp"}
+        self.ip_connections = {}  # ip -> number of active connections
+        self.persisted = set()  # ids written to the active_connections table
+
+    def add(self, ip: str, content: str):
+        id = str(uuid.uuid4())
+        self.connections[id] = {
+            "id": id,
+            "ip": ip,
+            "content": content,
+            "timestamp": time.time(),
+        }
+        self.ip_connections[ip] = self.ip_connections.get(ip, 0) + 1
+
+        return id
+
+    def remove(self, id: str):
+        connection = self.connections.pop(id, None)
+        if connection is None:
+            return
+
+        ip = connection["ip"]
+        self.ip_connections[ip] -= 1
+        if self.ip_connections[ip] == 0:
+            del self.ip_connections[ip]
+
+    def count(self, ip: str):
+        return self.ip_connections.get(ip, 0)
+
+    async def snapshot(self):
+        # Mirrors this worker's connections into the active_connections table
+        try:
+            current = set(self.connections)
+
+            closed = self.persisted - current
+            if closed:
+                await database.execute_many(
+                    "DELETE FROM active_connections WHERE id = :id",
+                    [{"id": id} for id in closed],
+                )
+
+            opened = current - self.persisted
+            if opened:
+                await database.execute_many(
+                    f"INSERT {'OR IGNORE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO active_connections (id, ip, content, timestamp) VALUES (:id, :ip, :content, :timestamp){' ON CONFLICT DO NOTHING' if settings.DATABASE_TYPE == 'postgresql' else ''}",
+                    [self.connections[id] for id in opened],
+                )
+
+            self.persisted = current
+        except Exception as e:
+            logger.warning(f"Exception while saving active connections: {e}")
+
+    async def snapshot_periodically(self):
+        while True:
+            await asyncio.sleep(settings.ACTIVE_CONNECTIONS_SNAPSHOT_INTERVAL)
+            await self.snapshot()
+
+
+connections = ConnectionTracker()
@@ -4,6 +4,50 @@ import time
 from comet.utils.logger import logger
 from comet.utils.models import database, settings
 
+# Keeps the most recent row of each (debridService, info_hash, name, season, episode)
+deduplicate_cache_query = (
+    "DELETE FROM cache WHERE rowid NOT IN (SELECT id FROM (SELECT rowid AS id, MAX(timestamp) FROM cache GROUP BY debridService, info_hash, name, season, episode))"
+    if settings.DATABASE_TYPE == "sqlite"
+    else "DELETE FROM cache WHERE ctid NOT IN (SELECT DISTINCT ON (debridService, info_hash, name, season, episode) ctid FROM cache ORDER BY debridService, info_hash, name, season, episode, timestamp DESC)"
+)
+
+# Each migration is a list of idempotent statements, the database remembers the last
+# one applied in schema_migrations - append new ones, never edit the existing ones
+migrations = [
+    [
+        "CREATE INDEX IF NOT EXISTS cache_lookup ON cache (debridService, name, season, episode, tracker, timestamp)",
+    ],
+    [
+        deduplicate_cache_query,
+        # NULL season/episode (movies) would never conflict without COALESCE
+        "CREATE UNIQUE INDEX IF NOT EXISTS cache_unique ON cache (debridService, info_hash, name, COALESCE(season, -1), COALESCE(episode, -1))",
+    ],
+]
+
+
+async def run_migrations():
+    await database.execute(
+        "CREATE TABLE IF NOT EXISTS schema_migrations (version INTEGER PRIMARY KEY, timestamp INTEGER)"
+    )
+    current_version = await database.fetch_val(
+        "SELECT MAX(version) FROM schema_migrations"
+    )
+
+    for version, statements in enumerate(migrations, start=1):
+        if current_version is not None and version <= current_version:
+            continue
+
+        async with database.transaction():
+            for statement in statements:
+                await database.execute(statement)
+
+            await database.execute(
+                f"INSERT {'OR IGNORE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO schema_migrations (version, timestamp) VALUES (:version, :timestamp){' ON CONFLICT DO NOTHING' if settings.DATABASE_TYPE == 'postgresql' else ''}",
+                {"version": version, "timestamp": time.time()},
+            )
+
+        logger.log("COMET", f"Database migrated to schema version {version}")
+
 
 async def setup_database():
     try:
@@ -28,6 +72,7 @@ async def setup_database():
 
         if old_structure:
             await database.execute("DROP TABLE IF EXISTS cache")
+            await database.execute("DROP TABLE IF EXISTS schema_migrations")
 
         await database.execute(
             "CREATE TABLE IF NOT EXISTS cache (debridService TEXT, info_hash TEXT, name TEXT, season INTEGER, episode INTEGER, tracker TEXT, data TEXT, timestamp INTEGER)"
@@ -35,6 +80,23 @@ async def setup_database():
         await database.execute(
             "CREATE TABLE IF NOT EXISTS download_links (debrid_key TEXT, hash TEXT, file_index TEXT, link TEXT, timestamp INTEGER, PRIMARY KEY (debrid_key, hash, file_index))"
         )
+        await database.execute(
+            "CREATE TABLE IF NOT EXISTS metadata (media_id TEXT PRIMARY KEY, name TEXT, year INTEGER, year_end INTEGER, timestamp INTEGER)"
+        )
+        await database.execute(
+            "CREATE TABLE IF NOT EXISTS aliases (media_id TEXT PRIMARY KEY, data TEXT, timestamp INTEGER)"
+        )
+        await database.execute(
+            "CREATE TABLE IF NOT EXISTS parsed_titles (raw_title TEXT PRIMARY KEY, data TEXT, timestamp INTEGER)"
+        )
+        await database.execute(
+            "CREATE TABLE IF NOT EXISTS torrent_hashes (link TEXT PRIMARY KEY, info_hash TEXT, timestamp INTEGER)"
+        )
+        await database.execute(
+            "CREATE TABLE IF NOT EXISTS stream_locks (lock_key TEXT PRIMARY KEY, owner TEXT, timestamp INTEGER)"
+        )
+        await run_migrations()
+
         await database.execute("DROP TABLE IF EXISTS active_connections")
         await database.execute(
             "CREATE TABLE IF NOT EXISTS active_connections (id TEXT PRIMARY KEY, ip TEXT, content TEXT, timestamp INTEGER)"
@@ -46,7 +108,40 @@ async def setup_database():
             DELETE FROM cache 
             WHERE timestamp + :cache_ttl < :current_time
             """,
-            {"cache_ttl": settings.CACHE_TTL, "current_time": time.time()},
+            {
+                "cache_ttl": settings.CACHE_TTL + settings.CACHE_STALE_TTL,
+                "current_time": time.time(),
+            },
+        )
+        await database.execute(
+            """
+            DELETE FROM metadata 
+            WHERE timestamp + :metadata_cache_ttl < :current_time
+            """,
+            {
+                "metadata_cache_ttl": settings.METADATA_CACHE_TTL,
+                "current_time": time.time(),
+            },
+        )
+        await database.execute(
+            """
+            DELETE FROM aliases 
+            WHERE timestamp + :aliases_cache_ttl < :current_time
+            """,
+            {
+                "aliases_cache_ttl": settings.ALIASES_CACHE_TTL,
+                "current_time": time.time(),
+            },
+        )
+        await database.execute(
+            """
+            DELETE FROM torrent_hashes 
+            WHERE timestamp + :torrent_hash_cache_ttl < :current_time
+            """,
+            {
+                "torrent_hash_cache_ttl": settings.TORRENT_HASH_CACHE_TTL,
+                "current_time": time.time(),
+            },
         )
     except Exception as e:
         logger.error(f"Error setting up the database: {e}")
@@ -57,3 +152,25 @@ async def teardown_database():
         await database.disconnect()
     except Exception as e:
         logger.error(f"Error tearing down the database: {e}")
+
+
+async def compact_cache():
+    rows = await database.fetch_val("SELECT COUNT(*) FROM cache")
+
+    await database.execute(deduplicate_cache_query)
+    await database.execute(
+        """
+        DELETE FROM cache 
+        WHERE timestamp + :cache_ttl < :current_time
+        """,
+        {
+            "cache_ttl": settings.CACHE_TTL + settings.CACHE_STALE_TTL,
+            "current_time": time.time(),
+        },
+    )
+    await database.execute("VACUUM")
+
+    logger.log(
+        "COMET",
+        f"Cache compacted: {rows} rows before, {await database.fetch_val('SELECT COUNT(*) FROM cache')} after",
+    )
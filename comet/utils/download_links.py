@@ -0,0 +1,184 @@
+import asyncio
+import time
+
+from comet.utils.cache import LRUCache
+from comet.utils.logger import logger
+from comet.utils.models import database, settings
+
+# (debrid api key, info hash, file index) -> download link
+download_links_cache = LRUCache(settings.DOWNLOAD_LINK_CACHE_SIZE)
+
+
+def get_download_link_ttl(debrid_service: str):
+    return settings.DOWNLOAD_LINK_TTL_PER_SERVICE.get(
+        debrid_service, settings.DOWNLOAD_LINK_TTL
+    )
+
+
+async def get_download_link(
+    debrid_service: str, debrid_key: str, hash: str, index: str
+):
+    key = (debrid_key, hash, index)
+    if key in generating:
+        # The link is being pre-generated, no need to ask the debrid service twice
+        await asyncio.shield(pregenerating[key])
+    elif key in pregenerating:
+        # Still queued behind other pre-generations, asking directly is faster
+        pregenerating[key].cancel()
+        pregeneration_stats["cancelled"] += 1
+
+    return await find_download_link(debrid_service, debrid_key, hash, index)
+
+
+async def find_download_link(
+    debrid_service: str, debrid_key: str, hash: str, index: str
+):
+    key = (debrid_key, hash, index)
+    download_link = download_links_cache.get(key)
+    if download_link is not None:
+        return download_link
+
+    cached_link = await database.fetch_one(
+        "SELECT link, timestamp FROM download_links WHERE debrid_key = :debrid_key AND hash = :hash AND file_index = :file_index",
+        {"debrid_key": debrid_key, "hash": hash, "file_index": index},
+    )
+    if cached_link:
+        remaining_ttl = (
+            cached_link["timestamp"]
+            + get_download_link_ttl(debrid_service)
+            - time.time()
+        )
+        if remaining_ttl > 0:
+            download_links_cache.set(key, cached_link["link"], remaining_ttl)
+
+            return cached_link["link"]
+
+    return None
+
+
+async def cache_download_link(
+    debrid_service: str, debrid_key: str, hash: str, index: str, download_link: str
+):
+    download_links_cache.set(
+        (debrid_key, hash, index),
+        download_link,
+        get_download_link_ttl(debrid_service),
+    )
+
+    await database.execute(
+        f"INSERT {'OR REPLACE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO download_links (debrid_key, hash, file_index, link, timestamp) VALUES (:debrid_key, :hash, :file_index, :link, :timestamp){' ON CONFLICT (debrid_key, hash, file_index) DO UPDATE SET link = EXCLUDED.link, timestamp = EXCLUDED.timestamp' if settings.DATABASE_TYPE == 'postgresql' else ''}",
+        {
+            "debrid_key": debrid_key,
+            "hash": hash,
+            "file_index": index,
+            "link": download_link,
+            "timestamp": time.time(),
+        },
+    )
+
+
+async def purge_download_links():
+    # Rows don't know their debrid service, they are kept for the longest lifetime
+    try:
+        await database.execute(
+            "DELETE FROM download_links WHERE timestamp + :download_link_ttl < :current_time",
+            {
+                "download_link_ttl": max(
+                    [
+                        settings.DOWNLOAD_LINK_TTL,
+                        *settings.DOWNLOAD_LINK_TTL_PER_SERVICE.values(),
+                    ]
+                ),
+                "current_time": time.time(),
+            },
+        )
+    except Exception as e:
+        logger.warning(f"Exception while purging expired download links: {e}")
+
+
+async def purge_download_links_periodically():
+    while True:
+        await purge_download_links()
+        await asyncio.sleep(settings.DOWNLOAD_LINK_PURGE_INTERVAL)
+
+
+pregeneration_slots = {}  # debrid api key -> semaphore
+pregeneration_budgets = {}  # debrid api key -> (window start, links generated)
+pregenerating = {}  # (debrid api key, info hash, file index) -> task
+generating = set()  # keys of the pre-generations holding a slot
+pregeneration_stats = {
+    "scheduled": 0,
+    "generated": 0,
+    "failed": 0,
+    "over_budget": 0,
+    "cancelled": 0,
+}
+
+
+def take_pregeneration_budget(debrid_key: str):
+    current_time = time.time()
+    window_start, used = pregeneration_budgets.get(debrid_key, (current_time, 0))
+    if current_time - window_start >= settings.PREGENERATE_LINKS_BUDGET_WINDOW:
+        window_start, used = current_time, 0
+
+    if used >= settings.PREGENERATE_LINKS_BUDGET:
+        return False
+
+    pregeneration_budgets[debrid_key] = (window_start, used + 1)
+    return True
+
+
+async def pregenerate_download_link(
+    debrid, debrid_service: str, debrid_key: str, hash: str, index: str
+):
+    try:
+        if await find_download_link(debrid_service, debrid_key, hash, index):
+            return
+
+        if not take_pregeneration_budget(debrid_key):
+            pregeneration_stats["over_budget"] += 1
+            return
+
+        pregeneration_stats["scheduled"] += 1
+        if debrid_key not in pregeneration_slots:
+            pregeneration_slots[debrid_key] = asyncio.Semaphore(
+                settings.PREGENERATE_LINKS_CONCURRENCY
+            )
+
+        async with pregeneration_slots[debrid_key]:
+            if download_links_cache.get((debrid_key, hash, index)) is not None:
+                return
+
+            generating.add((debrid_key, hash, index))
+            download_link = await debrid.generate_download_link(hash, index)
+
+        if not download_link:
+            pregeneration_stats["failed"] += 1
+            return
+
+        await cache_download_link(
+            debrid_service, debrid_key, hash, index, download_link
+        )
+        pregeneration_stats["generated"] += 1
+    except Exception as e:
+        pregeneration_stats["failed"] += 1
+        logger.warning(f"Exception while pre-generating download link for {hash}: {e}")
+    finally:
+        generating.discard((debrid_key, hash, index))
+        pregenerating.pop((debrid_key, hash, index), None)
+
+
+async def pregenerate_download_links(
+    debrid, debrid_service: str, debrid_key: str, files: list
+):
+    # files are (info hash, file index) of the top results, in response order
+    # The key is reserved before anything is awaited, so concurrent searches
+    # never schedule the same file twice
+    for hash, index in files:
+        key = (debrid_key, hash, index)
+        if key in pregenerating:
+            continue
+
+        pregenerating[key] = asyncio.create_task(
+            pregenerate_download_link(debrid, debrid_service, debrid_key, hash, index)
+        )
@@ -6,14 +6,19 @@ import bencodepy
 import PTT
 import asyncio
 import orjson
+import threading
 import time
 
-from RTN import parse, title_match
-from curl_cffi import requests
+from contextlib import AsyncExitStack, asynccontextmanager
+from RTN import parse, title_match, ParsedData, Torrent
+from RTN.fetch import check_fetch
+from RTN.ranker import get_rank
 from fastapi import Request
 
+from comet.utils.cache import LRUCache
+from comet.utils.clients import clients
 from comet.utils.logger import logger
-from comet.utils.models import database, settings, ConfigModel
+from comet.utils.models import database, rtn, settings, ConfigModel
 
 languages_emojis = {
     "unknown": "❓",  # Unknown
@@ -220,6 +225,87 @@ def is_video(title: str):
     return title.endswith(video_extensions)
 
 
+parse_cache = LRUCache(settings.PARSE_CACHE_SIZE)
+parse_cache_lock = threading.Lock()  # the thread parse executor shares it
+parse_cache_pending = {}  # parsed since the last persist
+
+
+def cached_parse(raw_title: str):
+    with parse_cache_lock:
+        parsed = parse_cache.get(raw_title)
+    if parsed is not None:
+        return parsed
+
+    parsed = parse(raw_title)
+    with parse_cache_lock:
+        parse_cache.set(raw_title, parsed)
+        if settings.PARSE_CACHE_PERSIST:
+            parse_cache_pending[raw_title] = parsed
+
+    return parsed
+
+
+async def load_parse_cache():
+    if not settings.PARSE_CACHE_PERSIST:
+        return
+
+    try:
+        rows = await database.fetch_all(
+            "SELECT raw_title, data FROM parsed_titles ORDER BY timestamp DESC LIMIT :limit",
+            {"limit": settings.PARSE_CACHE_SIZE},
+        )
+        loaded = 0
+        for row in reversed(rows):
+            try:
+                parsed = ParsedData(**orjson.loads(row["data"]))
+            except Exception:
+                continue  # saved by another RTN version, parsed again when needed
+
+            parse_cache.set(row["raw_title"], parsed)
+            loaded += 1
+
+        logger.info(f"{loaded} parsed titles loaded from the database")
+    except Exception as e:
+        logger.warning(f"Exception while loading parsed titles: {e}")
+
+
+async def persist_parse_cache():
+    if not parse_cache_pending:
+        return
+
+    with parse_cache_lock:
+        pending = list(parse_cache_pending.items())
+        parse_cache_pending.clear()
+
+    current_time = time.time()
+    try:
+        await database.execute_many(
+            f"INSERT {'OR REPLACE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO parsed_titles (raw_title, data, timestamp) VALUES (:raw_title, :data, :timestamp){' ON CONFLICT (raw_title) DO UPDATE SET data = EXCLUDED.data, timestamp = EXCLUDED.timestamp' if settings.DATABASE_TYPE == 'postgresql' else ''}",
+            [
+                {
+                    "raw_title": raw_title,
+                    "data": orjson.dumps(parsed.model_dump()).decode("utf-8"),
+                    "timestamp": current_time,
+                }
+                for raw_title, parsed in pending
+            ],
+        )
+
+        # Only the newest titles are loaded back, older rows are trimmed
+        await database.execute(
+            "DELETE FROM parsed_titles WHERE timestamp < (SELECT timestamp FROM parsed_titles ORDER BY timestamp DESC LIMIT 1 OFFSET :limit)",
+            {"limit": settings.PARSE_CACHE_SIZE},
+        )
+    except Exception as e:
+        logger.warning(f"Exception while persisting parsed titles: {e}")
+
+
+async def persist_parse_cache_periodically():
+    while True:
+        await asyncio.sleep(settings.PARSE_CACHE_PERSIST_INTERVAL)
+        await persist_parse_cache()
+
+
 def bytes_to_size(bytes: int):
     sizes = ["Bytes", "KB", "MB", "GB", "TB"]
     if bytes == 0:
@@ -257,24 +343,71 @@ def get_debrid_extension(debridService: str, debridApiKey: str = None):
     return debrid_extensions.get(debridService, None)
 
 
+prowlarr_indexers = {}  # lowercased name and definition name -> indexer id
+prowlarr_indexers_lock = asyncio.Lock()
+
+
+async def refresh_prowlarr_indexers(session: aiohttp.ClientSession):
+    try:
+        get_indexers = await session.get(
+            f"{settings.INDEXER_MANAGER_URL}/api/v1/indexer",
+            headers={"X-Api-Key": settings.INDEXER_MANAGER_API_KEY},
+        )
+        get_indexers = await get_indexers.json()
+
+        indexers = {}
+        for indexer in get_indexers:
+            indexers[indexer["name"].lower()] = indexer["id"]
+            indexers[indexer["definitionName"].lower()] = indexer["id"]
+
+        prowlarr_indexers.clear()
+        prowlarr_indexers.update(indexers)
+    except Exception as e:
+        logger.warning(f"Exception while getting Prowlarr indexers: {e}")
+
+
+async def refresh_prowlarr_indexers_periodically(session: aiohttp.ClientSession):
+    while True:
+        await asyncio.sleep(settings.INDEXER_MANAGER_REFRESH_INTERVAL)
+        await refresh_prowlarr_indexers(session)
+
+
+indexer_manager_stats = {
+    "searches": 0,
+    "upstream_calls": 0,
+    "upstream_calls_saved": 0,
+    "merged_results": 0,
+}
+
+
+def plan_search_queries(queries: list):
+    # Indexer managers search case-insensitively, so only distinct queries are sent
+    planned_queries = {}
+    for query in queries:
+        planned_queries.setdefault(" ".join(query.split()).lower(), query)
+
+    return list(planned_queries.values())
+
+
 async def get_indexer_manager(
     session: aiohttp.ClientSession,
     indexer_manager_type: str,
     indexers: list,
-    query: str,
+    queries: list,
 ):
     results = []
     try:
         indexers = [indexer.replace("_", " ") for indexer in indexers]
+        planned_queries = plan_search_queries(queries)
 
         if indexer_manager_type == "jackett":
 
             async def fetch_jackett_results(
-                session: aiohttp.ClientSession, indexer: str, query: str
+                session: aiohttp.ClientSession, indexers: list, query: str
             ):
                 try:
                     async with session.get(
-                        f"{settings.INDEXER_MANAGER_URL}/api/v2.0/indexers/all/results?apikey={settings.INDEXER_MANAGER_API_KEY}&Query={query}&Tracker[]={indexer}",
+                        f"{settings.INDEXER_MANAGER_URL}/api/v2.0/indexers/all/results?apikey={settings.INDEXER_MANAGER_API_KEY}&Query={query}&Tracker[]={'&Tracker[]='.join(indexers)}",
                         timeout=aiohttp.ClientTimeout(
                             total=settings.INDEXER_MANAGER_TIMEOUT
                         ),
@@ -283,58 +416,98 @@ async def get_indexer_manager(
                         return response_json.get("Results", [])
                 except Exception as e:
                     logger.warning(
-                        f"Exception while fetching Jackett results for indexer {indexer}: {e}"
+                        f"Exception while fetching Jackett results for indexers {indexers}: {e}"
                     )
                     return []
 
+            batch_size = settings.INDEXER_MANAGER_JACKETT_BATCH_SIZE or len(indexers)
             tasks = [
-                fetch_jackett_results(session, indexer, query) for indexer in indexers
+                fetch_jackett_results(session, indexers[i : i + batch_size], query)
+                for query in planned_queries
+                for i in range(0, len(indexers), batch_size)
             ]
+            upstream_calls = len(tasks)
+            unplanned_calls = len(queries) * len(indexers)
             all_results = await asyncio.gather(*tasks)
 
             for result_set in all_results:
                 results.extend(result_set)
 
         elif indexer_manager_type == "prowlarr":
-            get_indexers = await session.get(
-                f"{settings.INDEXER_MANAGER_URL}/api/v1/indexer",
-                headers={"X-Api-Key": settings.INDEXER_MANAGER_API_KEY},
-            )
-            get_indexers = await get_indexers.json()
+            if len(prowlarr_indexers) == 0:
+                async with prowlarr_indexers_lock:
+                    if len(prowlarr_indexers) == 0:
+                        await refresh_prowlarr_indexers(session)
 
             indexers_id = []
-            for indexer in get_indexers:
-                if (
-                    indexer["name"].lower() in indexers
-                    or indexer["definitionName"].lower() in indexers
-                ):
-                    indexers_id.append(indexer["id"])
-
-            response = await session.get(
-                f"{settings.INDEXER_MANAGER_URL}/api/v1/search?query={query}&indexerIds={'&indexerIds='.join(str(indexer_id) for indexer_id in indexers_id)}&type=search",
-                headers={"X-Api-Key": settings.INDEXER_MANAGER_API_KEY},
+            for indexer in indexers:
+                indexer_id = prowlarr_indexers.get(indexer)
+                if indexer_id is not None and indexer_id not in indexers_id:
+                    indexers_id.append(indexer_id)
+
+            async def fetch_prowlarr_results(
+                session: aiohttp.ClientSession, query: str
+            ):
+                try:
+                    response = await session.get(
+                        f"{settings.INDEXER_MANAGER_URL}/api/v1/search?query={query}&indexerIds={'&indexerIds='.join(str(indexer_id) for indexer_id in indexers_id)}&type=search",
+                        headers={"X-Api-Key": settings.INDEXER_MANAGER_API_KEY},
+                    )
+                    return await response.json()
+                except Exception as e:
+                    logger.warning(
+                        f"Exception while fetching Prowlarr results for {query}: {e}"
+                    )
+                    return []
+
+            upstream_calls = len(planned_queries)
+            unplanned_calls = len(queries)
+            all_results = await asyncio.gather(
+                *[fetch_prowlarr_results(session, query) for query in planned_queries]
             )
-            response = await response.json()
 
-            for result in response:
-                result["InfoHash"] = (
-                    result["infoHash"] if "infoHash" in result else None
-                )
-                result["Title"] = result["title"]
-                result["Size"] = result["size"]
-                result["Link"] = (
-                    result["downloadUrl"] if "downloadUrl" in result else None
-                )
-                result["Tracker"] = result["indexer"]
+            for response in all_results:
+                for result in response:
+                    result["InfoHash"] = (
+                        result["infoHash"] if "infoHash" in result else None
+                    )
+                    result["Title"] = result["title"]
+                    result["Size"] = result["size"]
+                    result["Link"] = (
+                        result["downloadUrl"] if "downloadUrl" in result else None
+                    )
+                    result["Tracker"] = result["indexer"]
 
-                results.append(result)
+                    results.append(result)
+        else:
+            return results
+
+        indexer_manager_stats["searches"] += 1
+        indexer_manager_stats["upstream_calls"] += upstream_calls
+        indexer_manager_stats["upstream_calls_saved"] += (
+            unplanned_calls - upstream_calls
+        )
     except Exception as e:
         logger.warning(
-            f"Exception while getting {indexer_manager_type} results for {query} with {indexers}: {e}"
+            f"Exception while getting {indexer_manager_type} results for {queries} with {indexers}: {e}"
         )
         pass
 
-    return results
+    # The same torrent is often returned by several queries or indexers
+    merged_results = []
+    info_hashes = set()
+    for result in results:
+        info_hash = result["InfoHash"].lower() if result.get("InfoHash") else None
+        if info_hash is not None:
+            if info_hash in info_hashes:
+                indexer_manager_stats["merged_results"] += 1
+                continue
+
+            info_hashes.add(info_hash)
+
+        merged_results.append(result)
+
+    return merged_results
 
 
 async def get_zilean(
@@ -374,17 +547,19 @@ async def get_torrentio(log_name: str, type: str, full_id: str):
     results = []
     try:
         try:
-            get_torrentio = requests.get(
+            response = await clients.scrape_session.get(
                 f"https://torrentio.strem.fun/stream/{type}/{full_id}.json"
-            ).json()
+            )
+            get_torrentio = response.json()
         except:
-            get_torrentio = requests.get(
+            response = await clients.scrape_session.get(
                 f"https://torrentio.strem.fun/stream/{type}/{full_id}.json",
                 proxies={
                     "http": settings.DEBRID_PROXY_URL,
                     "https": settings.DEBRID_PROXY_URL,
                 },
-            ).json()
+            )
+            get_torrentio = response.json()
 
         for torrent in get_torrentio["streams"]:
             title_full = torrent["title"]
@@ -414,17 +589,19 @@ async def get_mediafusion(log_name: str, type: str, full_id: str):
     results = []
     try:
         try:
-            get_mediafusion = requests.get(
+            response = await clients.scrape_session.get(
                 f"{settings.MEDIAFUSION_URL}/stream/{type}/{full_id}.json"
-            ).json()
+            )
+            get_mediafusion = response.json()
         except:
-            get_mediafusion = requests.get(
+            response = await clients.scrape_session.get(
                 f"{settings.MEDIAFUSION_URL}/stream/{type}/{full_id}.json",
                 proxies={
                     "http": settings.DEBRID_PROXY_URL,
                     "https": settings.DEBRID_PROXY_URL,
                 },
-            ).json()
+            )
+            get_mediafusion = response.json()
 
         for torrent in get_mediafusion["streams"]:
             title_full = torrent["description"]
@@ -453,7 +630,7 @@ async def get_mediafusion(log_name: str, type: str, full_id: str):
     return results
 
 
-async def filter(
+def filter(
     torrents: list,
     name: str,
     year: int,
@@ -469,7 +646,7 @@ async def filter(
         if "\n" in title:  # Torrentio title parsing
             title = title.split("\n")[1]
 
-        parsed = parse(title)
+        parsed = cached_parse(title)
 
         if remove_adult_content and parsed.adult:
             results.append((index, False))
@@ -496,40 +673,219 @@ async def filter(
     return results
 
 
-async def get_torrent_hash(session: aiohttp.ClientSession, torrent: tuple):
-    index = torrent[0]
-    torrent = torrent[1]
-    if "InfoHash" in torrent and torrent["InfoHash"] is not None:
-        return (index, torrent["InfoHash"].lower())
+def rank_torrents(torrents: list):
+    # Same as rtn.rank(title, hash, remove_trash=False) but reusing cached parse results
+    ranked_torrents = []
+    for title, hash in torrents:
+        try:
+            if not title or len(hash) != 40:
+                continue
+
+            parsed = cached_parse(title)
+            is_fetchable, _ = check_fetch(parsed, rtn.settings, True)
+            rank = get_rank(parsed, rtn.settings, rtn.ranking_model)
+            if rank < rtn.settings.options["remove_ranks_under"]:
+                continue
+
+            ranked_torrents.append(
+                Torrent(
+                    infohash=hash,
+                    raw_title=title,
+                    data=parsed,
+                    fetch=is_fetchable,
+                    rank=rank,
+                    lev_ratio=0.0,
+                )
+            )
+        except:
+            pass
 
-    url = torrent["Link"]
+    return ranked_torrents
 
-    try:
-        timeout = aiohttp.ClientTimeout(total=settings.GET_TORRENT_TIMEOUT)
-        response = await session.get(url, allow_redirects=False, timeout=timeout)
+
+torrent_download_slots = (
+    asyncio.Semaphore(settings.GET_TORRENT_MAX_CONCURRENCY)
+    if settings.GET_TORRENT_MAX_CONCURRENCY > 0
+    else None
+)
+torrent_download_indexer_slots = {}
+
+
+@asynccontextmanager
+async def torrent_download_slot(indexer: str):
+    async with AsyncExitStack() as slots:
+        # The indexer slot is taken first so a busy indexer doesn't hold global slots
+        if settings.GET_TORRENT_MAX_CONCURRENCY_PER_INDEXER > 0:
+            if indexer not in torrent_download_indexer_slots:
+                torrent_download_indexer_slots[indexer] = asyncio.Semaphore(
+                    settings.GET_TORRENT_MAX_CONCURRENCY_PER_INDEXER
+                )
+            await slots.enter_async_context(torrent_download_indexer_slots[indexer])
+
+        if torrent_download_slots is not None:
+            await slots.enter_async_context(torrent_download_slots)
+
+        yield
+
+
+async def download_torrent_hash(session: aiohttp.ClientSession, url: str):
+    timeout = aiohttp.ClientTimeout(total=settings.GET_TORRENT_TIMEOUT)
+    async with session.get(url, allow_redirects=False, timeout=timeout) as response:
         if response.status == 200:
             torrent_data = await response.read()
             torrent_dict = bencodepy.decode(torrent_data)
             info = bencodepy.encode(torrent_dict[b"info"])
-            hash = hashlib.sha1(info).hexdigest()
-        else:
-            location = response.headers.get("Location", "")
-            if not location:
-                return (index, None)
+            return hashlib.sha1(info).hexdigest()
+
+        location = response.headers.get("Location", "")
+        if not location:
+            return None
+
+        match = info_hash_pattern.search(location)
+        if not match:
+            return None
+
+        return match.group(1)
 
-            match = info_hash_pattern.search(location)
-            if not match:
-                return (index, None)
 
-            hash = match.group(1).upper()
+torrent_hash_cache = LRUCache(
+    settings.TORRENT_HASH_CACHE_SIZE, settings.TORRENT_HASH_CACHE_TTL
+)
+torrent_hash_stats = {"database_hits": 0, "downloads": 0}
 
-        return (index, hash.lower())
+
+async def get_cached_torrent_hash(torrent: dict):
+    if "InfoHash" in torrent and torrent["InfoHash"] is not None:
+        return torrent["InfoHash"].lower()
+
+    # Download links are stable per indexer, only unknown ones are fetched
+    url = torrent["Link"]
+    hash = torrent_hash_cache.get(url)
+    if hash is not None:
+        return hash
+
+    cached_hash = await database.fetch_one(
+        "SELECT info_hash, timestamp FROM torrent_hashes WHERE link = :link",
+        {"link": url},
+    )
+    if cached_hash:
+        remaining_ttl = (
+            cached_hash["timestamp"] + settings.TORRENT_HASH_CACHE_TTL - time.time()
+        )
+        if remaining_ttl > 0:
+            torrent_hash_stats["database_hits"] += 1
+            torrent_hash_cache.set(url, cached_hash["info_hash"], remaining_ttl)
+
+            return cached_hash["info_hash"]
+
+    return None
+
+
+async def get_torrent_hash(session: aiohttp.ClientSession, torrent: dict):
+    url = torrent["Link"]
+    indexer = (
+        torrent["indexer"]
+        if "indexer" in torrent
+        else (torrent["Tracker"] if "Tracker" in torrent else "")
+    )
+
+    try:
+        async with torrent_download_slot(indexer):
+            torrent_hash_stats["downloads"] += 1
+            hash = await download_torrent_hash(session, url)
     except Exception as e:
         logger.warning(
-            f"Exception while getting torrent info hash for {torrent['indexer'] if 'indexer' in torrent else (torrent['Tracker'] if 'Tracker' in torrent else '')}|{url}: {e}"
+            f"Exception while getting torrent info hash for {indexer}|{url}: {e}"
         )
 
-        return (index, None)
+        return None
+
+    if hash is None:
+        return None
+
+    hash = hash.lower()
+    torrent_hash_cache.set(url, hash)
+    try:
+        await database.execute(
+            f"INSERT {'OR REPLACE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO torrent_hashes (link, info_hash, timestamp) VALUES (:link, :info_hash, :timestamp){' ON CONFLICT (link) DO UPDATE SET info_hash = EXCLUDED.info_hash, timestamp = EXCLUDED.timestamp' if settings.DATABASE_TYPE == 'postgresql' else ''}",
+            {"link": url, "info_hash": hash, "timestamp": time.time()},
+        )
+    except Exception as e:
+        logger.warning(f"Exception while caching torrent info hash for {url}: {e}")
+
+    return hash
+
+
+resolution_priority = [
+    "2160p",
+    "1440p",
+    "1080p",
+    "720p",
+    "576p",
+    "480p",
+    "360p",
+    "240p",
+]
+
+
+def get_torrent_priority(torrent: dict, config_resolutions: list):
+    resolution = cached_parse(torrent["Title"]).resolution.lower()
+    return (
+        "all" not in config_resolutions and resolution not in config_resolutions,
+        (
+            resolution_priority.index(resolution)
+            if resolution in resolution_priority
+            else len(resolution_priority)
+        ),
+    )
+
+
+async def get_torrent_hashes(
+    session: aiohttp.ClientSession, torrents: list, config: dict
+):
+    hashes = await asyncio.gather(
+        *[get_cached_torrent_hash(torrent) for torrent in torrents]
+    )
+    torrent_hashes = [(i, hashes[i]) for i in range(len(torrents))]
+
+    # Returns (torrent_hashes, complete) - an early stop depends on the user's
+    # settings, incomplete results must not be shared
+    enough_hashes = config["maxResults"] * settings.GET_TORRENT_EARLY_STOP_FACTOR
+    found = len(torrents) - hashes.count(None)
+    if enough_hashes > 0 and found >= enough_hashes:
+        return torrent_hashes, found == len(torrents)
+
+    # Download slots are handed out in order, so the most promising torrents go first
+    config_resolutions = [resolution.lower() for resolution in config["resolutions"]]
+    to_download = sorted(
+        [i for i in range(len(torrents)) if hashes[i] is None],
+        key=lambda i: get_torrent_priority(torrents[i], config_resolutions),
+    )
+
+    async def download(i: int):
+        return (i, await get_torrent_hash(session, torrents[i]))
+
+    tasks = [asyncio.create_task(download(i)) for i in to_download]
+    if enough_hashes <= 0:
+        for hash in await asyncio.gather(*tasks):
+            torrent_hashes[hash[0]] = hash
+
+        return torrent_hashes, True
+
+    completed = 0
+    for task in asyncio.as_completed(tasks):
+        hash = await task
+        torrent_hashes[hash[0]] = hash
+        completed += 1
+        if hash[1] is not None:
+            found += 1
+            if found >= enough_hashes:
+                break
+
+    for task in tasks:
+        task.cancel()
+
+    return torrent_hashes, completed == len(tasks)
 
 
 def get_balanced_hashes(hashes: dict, config: dict):
@@ -682,25 +1038,6 @@ def get_client_ip(request: Request):
     )
 
 
-async def get_aliases(session: aiohttp.ClientSession, media_type: str, media_id: str):
-    aliases = {}
-    try:
-        response = await session.get(
-            f"https://api.trakt.tv/{media_type}/{media_id}/aliases"
-        )
-
-        for aliase in await response.json():
-            country = aliase["country"]
-            if country not in aliases:
-                aliases[country] = []
-
-            aliases[country].append(aliase["title"])
-    except:
-        pass
-
-    return aliases
-
-
 async def add_torrent_to_cache(
     config: dict, name: str, season: int, episode: int, sorted_ranked_files: dict
 ):
@@ -721,10 +1058,10 @@ async def add_torrent_to_cache(
     ]
 
     query = f"""
-        INSERT {'OR IGNORE ' if settings.DATABASE_TYPE == 'sqlite' else ''}
+        INSERT {'OR REPLACE ' if settings.DATABASE_TYPE == 'sqlite' else ''}
         INTO cache (debridService, info_hash, name, season, episode, tracker, data, timestamp)
         VALUES (:debridService, :info_hash, :name, :season, :episode, :tracker, :data, :timestamp)
-        {' ON CONFLICT DO NOTHING' if settings.DATABASE_TYPE == 'postgresql' else ''}
+        {' ON CONFLICT (debridService, info_hash, name, COALESCE(season, -1), COALESCE(episode, -1)) DO UPDATE SET tracker = EXCLUDED.tracker, data = EXCLUDED.data, timestamp = EXCLUDED.timestamp' if settings.DATABASE_TYPE == 'postgresql' else ''}
     """
 
     await database.execute_many(query, values)
@@ -0,0 +1,220 @@
+import aiohttp
+import asyncio
+import orjson
+import time
+
+from comet.utils.cache import LRUCache
+from comet.utils.logger import logger
+from comet.utils.models import database, settings
+
+metadata_cache = LRUCache(settings.METADATA_CACHE_SIZE)
+metadata_stats = {"database_hits": 0, "fetches": 0, "failed_fetches": 0}
+
+
+async def fetch_metadata(session: aiohttp.ClientSession, media_id: str):
+    if media_id.startswith("kitsu:"):
+        get_metadata = await session.get(
+            f"https://kitsu.io/api/edge/anime/{media_id.split(':')[1]}"
+        )
+        metadata = await get_metadata.json()
+
+        return {
+            "name": metadata["data"]["attributes"]["canonicalTitle"],
+            "year": None,
+            "year_end": None,
+        }
+
+    get_metadata = await session.get(
+        f"https://v3.sg.media-imdb.com/suggestion/a/{media_id}.json"
+    )
+    metadata = await get_metadata.json()
+    element = metadata["d"][
+        (
+            0
+            if metadata["d"][0]["id"] not in ["/imdbpicks/summer-watch-guide", "/emmys"]
+            else 1
+        )
+    ]
+
+    for element in metadata["d"]:
+        if "/" not in element["id"]:
+            break
+
+    year_end = None
+    if "yr" in element:
+        year_end = int(element["yr"].split("-")[1])
+
+    return {"name": element["l"], "year": element.get("y"), "year_end": year_end}
+
+
+async def get_metadata(session: aiohttp.ClientSession, media_id: str):
+    # Negative results are cached with a name of None
+    metadata = metadata_cache.get(media_id)
+    if metadata is not None:
+        return metadata if metadata["name"] is not None else None
+
+    current_time = time.time()
+    cached = await database.fetch_one(
+        "SELECT name, year, year_end, timestamp FROM metadata WHERE media_id = :media_id",
+        {"media_id": media_id},
+    )
+    if cached:
+        ttl = (
+            settings.METADATA_CACHE_TTL
+            if cached["name"] is not None
+            else settings.METADATA_NEGATIVE_CACHE_TTL
+        )
+        remaining_ttl = cached["timestamp"] + ttl - current_time
+        if remaining_ttl > 0:
+            metadata_stats["database_hits"] += 1
+            metadata = {
+                "name": cached["name"],
+                "year": cached["year"],
+                "year_end": cached["year_end"],
+            }
+            metadata_cache.set(media_id, metadata, remaining_ttl)
+
+            return metadata if metadata["name"] is not None else None
+
+    metadata_stats["fetches"] += 1
+    try:
+        metadata = await fetch_metadata(session, media_id)
+        ttl = settings.METADATA_CACHE_TTL
+    except Exception as e:
+        logger.warning(f"Exception while getting metadata for {media_id}: {e}")
+
+        metadata_stats["failed_fetches"] += 1
+        metadata = {"name": None, "year": None, "year_end": None}
+        ttl = settings.METADATA_NEGATIVE_CACHE_TTL
+
+    metadata_cache.set(media_id, metadata, ttl)
+    try:
+        await database.execute(
+            f"INSERT {'OR REPLACE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO metadata (media_id, name, year, year_end, timestamp) VALUES (:media_id, :name, :year, :year_end, :timestamp){' ON CONFLICT (media_id) DO UPDATE SET name = EXCLUDED.name, year = EXCLUDED.year, year_end = EXCLUDED.year_end, timestamp = EXCLUDED.timestamp' if settings.DATABASE_TYPE == 'postgresql' else ''}",
+            {"media_id": media_id, **metadata, "timestamp": current_time},
+        )
+    except Exception as e:
+        logger.warning(f"Exception while caching metadata for {media_id}: {e}")
+
+    return metadata if metadata["name"] is not None else None
+
+
+aliases_cache = LRUCache(settings.METADATA_CACHE_SIZE)
+aliases_stats = {
+    "database_hits": 0,
+    "fetches": 0,
+    "failed_fetches": 0,
+    "background_refreshes": 0,
+}
+aliases_refreshing = {}
+
+
+async def fetch_aliases(session: aiohttp.ClientSession, media_type: str, media_id: str):
+    aliases = {}
+    response = await session.get(
+        f"https://api.trakt.tv/{media_type}/{media_id}/aliases"
+    )
+
+    for aliase in await response.json():
+        country = aliase["country"]
+        if country not in aliases:
+            aliases[country] = []
+
+        aliases[country].append(aliase["title"])
+
+    return aliases
+
+
+async def cache_aliases(media_id: str, aliases: dict, timestamp: float):
+    # Failed lookups are cached as None
+    aliases_cache.set(
+        media_id,
+        (aliases, timestamp),
+        (
+            settings.ALIASES_CACHE_TTL
+            if aliases is not None
+            else settings.ALIASES_NEGATIVE_CACHE_TTL
+        ),
+    )
+
+    try:
+        await database.execute(
+            f"INSERT {'OR REPLACE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO aliases (media_id, data, timestamp) VALUES (:media_id, :data, :timestamp){' ON CONFLICT (media_id) DO UPDATE SET data = EXCLUDED.data, timestamp = EXCLUDED.timestamp' if settings.DATABASE_TYPE == 'postgresql' else ''}",
+            {
+                "media_id": media_id,
+                "data": (
+                    orjson.dumps(aliases).decode("utf-8")
+                    if aliases is not None
+                    else None
+                ),
+                "timestamp": timestamp,
+            },
+        )
+    except Exception as e:
+        logger.warning(f"Exception while caching aliases for {media_id}: {e}")
+
+
+async def refresh_aliases(
+    session: aiohttp.ClientSession, media_type: str, media_id: str
+):
+    try:
+        aliases = await fetch_aliases(session, media_type, media_id)
+        await cache_aliases(media_id, aliases, time.time())
+    except Exception as e:
+        logger.warning(f"Exception while refreshing aliases for {media_id}: {e}")
+    finally:
+        del aliases_refreshing[media_id]
+
+
+async def get_aliases(session: aiohttp.ClientSession, media_type: str, media_id: str):
+    current_time = time.time()
+
+    cached = aliases_cache.get(media_id)
+    if cached is None:
+        cached_aliases = await database.fetch_one(
+            "SELECT data, timestamp FROM aliases WHERE media_id = :media_id",
+            {"media_id": media_id},
+        )
+        if cached_aliases:
+            aliases = (
+                orjson.loads(cached_aliases["data"])
+                if cached_aliases["data"] is not None
+                else None
+            )
+            ttl = (
+                settings.ALIASES_CACHE_TTL
+                if aliases is not None
+                else settings.ALIASES_NEGATIVE_CACHE_TTL
+            )
+            remaining_ttl = cached_aliases["timestamp"] + ttl - current_time
+            if remaining_ttl > 0:
+                aliases_stats["database_hits"] += 1
+                cached = (aliases, cached_aliases["timestamp"])
+                aliases_cache.set(media_id, cached, remaining_ttl)
+
+    if cached is None:
+        aliases_stats["fetches"] += 1
+        try:
+            aliases = await fetch_aliases(session, media_type, media_id)
+        except Exception as e:
+            logger.warning(f"Exception while getting aliases for {media_id}: {e}")
+
+            aliases_stats["failed_fetches"] += 1
+            aliases = None
+
+        await cache_aliases(media_id, aliases, current_time)
+
+        return aliases if aliases is not None else {}
+
+    aliases, timestamp = cached
+    if (
+        aliases is not None
+        and current_time - timestamp > settings.ALIASES_CACHE_REFRESH
+        and media_id not in aliases_refreshing
+    ):
+        aliases_stats["background_refreshes"] += 1
+        aliases_refreshing[media_id] = asyncio.create_task(
+            refresh_aliases(session, media_type, media_id)
+        )
+
+    return aliases if aliases is not None else {}
@@ -2,7 +2,7 @@ import os
 import random
 import string
 
-from typing import List, Optional
+from typing import Dict, List, Optional
 from databases import Database
 from pydantic import BaseModel, field_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
@@ -22,26 +22,79 @@ class AppSettings(BaseSettings):
     DATABASE_URL: Optional[str] = "username:password@hostname:port"
     DATABASE_PATH: Optional[str] = "data/comet.db"
     CACHE_TTL: Optional[int] = 86400
+    CACHE_STALE_TTL: Optional[int] = 0
+    METADATA_CACHE_TTL: Optional[int] = 604800
+    METADATA_NEGATIVE_CACHE_TTL: Optional[int] = 600
+    METADATA_CACHE_SIZE: Optional[int] = 10000
+    ALIASES_CACHE_TTL: Optional[int] = 2592000
+    ALIASES_CACHE_REFRESH: Optional[int] = 604800
+    ALIASES_NEGATIVE_CACHE_TTL: Optional[int] = 3600
     DEBRID_PROXY_URL: Optional[str] = None
+    DEBRID_AVAILABILITY_CACHE_TTL: Optional[int] = 900
+    DEBRID_AVAILABILITY_CACHE_SIZE: Optional[int] = 50000
+    HTTP_MAX_CONNECTIONS: Optional[int] = 0
+    HTTP_MAX_CONNECTIONS_PER_HOST: Optional[int] = 0
+    HTTP_KEEPALIVE_TIMEOUT: Optional[int] = 30
+    HTTP_DNS_CACHE_TTL: Optional[int] = 300
     INDEXER_MANAGER_TYPE: Optional[str] = None
     INDEXER_MANAGER_URL: Optional[str] = "http://127.0.0.1:9117"
     INDEXER_MANAGER_API_KEY: Optional[str] = None
     INDEXER_MANAGER_TIMEOUT: Optional[int] = 30
     INDEXER_MANAGER_INDEXERS: List[str] = []
+    INDEXER_MANAGER_REFRESH_INTERVAL: Optional[int] = 3600
+    INDEXER_MANAGER_JACKETT_BATCH_SIZE: Optional[int] = 1
     GET_TORRENT_TIMEOUT: Optional[int] = 5
+    TORRENT_HASH_CACHE_TTL: Optional[int] = 2592000
+    TORRENT_HASH_CACHE_SIZE: Optional[int] = 100000
+    GET_TORRENT_MAX_CONCURRENCY: Optional[int] = 20
+    GET_TORRENT_MAX_CONCURRENCY_PER_INDEXER: Optional[int] = 5
+    GET_TORRENT_EARLY_STOP_FACTOR: Optional[int] = 0
     ZILEAN_URL: Optional[str] = None
     ZILEAN_TAKE_FIRST: Optional[int] = 500
     SCRAPE_TORRENTIO: Optional[bool] = False
     SCRAPE_MEDIAFUSION: Optional[bool] = False
     MEDIAFUSION_URL: Optional[str] = "https://mediafusion.elfhosted.com"
+    SCRAPE_DEADLINE: Optional[float] = 0
+    SCRAPE_TIMEOUT: Optional[int] = 30
+    SEASON_PACK_FANOUT: Optional[bool] = False
     CUSTOM_HEADER_HTML: Optional[str] = None
     PROXY_DEBRID_STREAM: Optional[bool] = False
     PROXY_DEBRID_STREAM_PASSWORD: Optional[str] = None
     PROXY_DEBRID_STREAM_MAX_CONNECTIONS: Optional[int] = -1
+    PROXY_DEBRID_STREAM_HTTP2: Optional[bool] = False
+    PROXY_DEBRID_STREAM_CHUNK_SIZE: Optional[int] = 0
+    PROXY_DEBRID_STREAM_READ_AHEAD: Optional[int] = 0
+    PROXY_DEBRID_STREAM_MAX_BANDWIDTH: Optional[int] = 0
+    PROXY_DEBRID_STREAM_MAX_BANDWIDTH_PER_IP: Optional[int] = 0
+    PROXY_DEBRID_STREAM_SEGMENTS: Optional[int] = 0
+    PROXY_DEBRID_STREAM_SEGMENT_SIZE: Optional[int] = 4194304
+    PROXY_DEBRID_STREAM_SEGMENTED_BYTES: Optional[int] = 33554432
+    PROXY_DEBRID_STREAM_CACHE_SIZE: Optional[int] = 0
+    PROXY_DEBRID_STREAM_CACHE_PATH: Optional[str] = "data/stream_cache"
+    PROXY_DEBRID_STREAM_CACHE_BLOCK_SIZE: Optional[int] = 4194304
+    ACTIVE_CONNECTIONS_SNAPSHOT_INTERVAL: Optional[int] = 0
     PROXY_DEBRID_STREAM_DEBRID_DEFAULT_SERVICE: Optional[str] = "realdebrid"
     PROXY_DEBRID_STREAM_DEBRID_DEFAULT_APIKEY: Optional[str] = None
+    DOWNLOAD_LINK_TTL: Optional[int] = 3600
+    DOWNLOAD_LINK_TTL_PER_SERVICE: Dict[str, int] = {}
+    DOWNLOAD_LINK_CACHE_SIZE: Optional[int] = 10000
+    DOWNLOAD_LINK_PURGE_INTERVAL: Optional[int] = 3600
+    PREGENERATE_LINKS: Optional[int] = 0
+    PREGENERATE_LINKS_CONCURRENCY: Optional[int] = 2
+    PREGENERATE_LINKS_BUDGET: Optional[int] = 30
+    PREGENERATE_LINKS_BUDGET_WINDOW: Optional[int] = 3600
     TITLE_MATCH_CHECK: Optional[bool] = True
+    PARSE_EXECUTOR: Optional[str] = "inline"
+    PARSE_EXECUTOR_WORKERS: Optional[int] = os.cpu_count() or 1
+    PARSE_CHUNK_SIZE: Optional[int] = 50
+    PARSE_INLINE_THRESHOLD: Optional[int] = 100
+    PARSE_CACHE_SIZE: Optional[int] = 100000
+    PARSE_CACHE_PERSIST: Optional[bool] = False
+    PARSE_CACHE_PERSIST_INTERVAL: Optional[int] = 300
     REMOVE_ADULT_CONTENT: Optional[bool] = False
+    STREAM_SINGLE_FLIGHT: Optional[bool] = True
+    STREAM_SINGLE_FLIGHT_CROSS_WORKER: Optional[bool] = False
+    STREAM_SINGLE_FLIGHT_TIMEOUT: Optional[int] = 60
 
     @field_validator("DASHBOARD_ADMIN_PASSWORD")
     def set_dashboard_admin_password(cls, v, values):
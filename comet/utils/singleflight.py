@@ -0,0 +1,84 @@
+import asyncio
+import time
+import uuid
+
+from comet.utils.logger import logger
+from comet.utils.models import database, settings
+
+
+class SingleFlight:
+    def __init__(self):
+        self.calls = {}
+        self.owner = str(uuid.uuid4())
+        self.stats = {
+            "executions": 0,
+            "coalesced": 0,
+            "cross_worker_waits": 0,
+        }
+
+    async def run(self, key: str, func, *args):
+        # Returns (result, leader) - only the leader should act on the result (caching...)
+        call = self.calls.get(key)
+        if call is not None:
+            self.stats["coalesced"] += 1
+            logger.info(f"Coalesced stream lookup for {key}")
+            return await asyncio.shield(call), False
+
+        call = asyncio.create_task(func(*args))
+        self.calls[key] = call
+        call.add_done_callback(lambda _: self.forget(key, call))
+        self.stats["executions"] += 1
+
+        return await asyncio.shield(call), True
+
+    def forget(self, key: str, call: asyncio.Task):
+        if self.calls.get(key) is call:
+            del self.calls[key]
+
+    async def acquire_lease(self, key: str):
+        current_time = time.time()
+        try:
+            await database.execute(
+                "DELETE FROM stream_locks WHERE lock_key = :lock_key AND timestamp + :timeout < :current_time",
+                {
+                    "lock_key": key,
+                    "timeout": settings.STREAM_SINGLE_FLIGHT_TIMEOUT,
+                    "current_time": current_time,
+                },
+            )
+            await database.execute(
+                f"INSERT {'OR IGNORE ' if settings.DATABASE_TYPE == 'sqlite' else ''}INTO stream_locks (lock_key, owner, timestamp) VALUES (:lock_key, :owner, :timestamp){' ON CONFLICT DO NOTHING' if settings.DATABASE_TYPE == 'postgresql' else ''}",
+                {"lock_key": key, "owner": self.owner, "timestamp": current_time},
+            )
+            lock = await database.fetch_one(
+                "SELECT owner FROM stream_locks WHERE lock_key = :lock_key",
+                {"lock_key": key},
+            )
+            return lock is None or lock["owner"] == self.owner
+        except Exception as e:
+            logger.warning(f"Exception while acquiring stream lock for {key}: {e}")
+            return True  # never block a request because of the lock table
+
+    async def wait_lease(self, key: str):
+        self.stats["cross_worker_waits"] += 1
+        deadline = time.time() + settings.STREAM_SINGLE_FLIGHT_TIMEOUT
+        while time.time() < deadline:
+            await asyncio.sleep(0.5)
+            lock = await database.fetch_one(
+                "SELECT owner FROM stream_locks WHERE lock_key = :lock_key",
+                {"lock_key": key},
+            )
+            if lock is None:
+                return
+
+    async def release_lease(self, key: str):
+        try:
+            await database.execute(
+                "DELETE FROM stream_locks WHERE lock_key = :lock_key AND owner = :owner",
+                {"lock_key": key, "owner": self.owner},
+            )
+        except Exception as e:
+            logger.warning(f"Exception while releasing stream lock for {key}: {e}")
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,196 @@
+import asyncio
+import re
+
+from collections import deque
+
+from comet.utils.logger import logger
+from comet.utils.models import settings
+
+
+def parse_range(range_header: str):
+    # Only "bytes=start-" and "bytes=start-end" are supported
+    match = re.fullmatch(r"bytes=(\d+)-(\d*)", range_header.strip())
+    if match is None:
+        return None
+
+    return int(match.group(1)), int(match.group(2)) if match.group(2) else None
+
+
+def parse_content_range(content_range: str):
+    match = re.fullmatch(r"bytes \d+-\d+/(\d+)", content_range.strip())
+    if match is None:
+        return None
+
+    return int(match.group(1))
+
+
+async def read_ahead(chunks, size: int):
+    # Upstream reads stay at most size chunks ahead of the client, a slow client pauses them
+    queue = asyncio.Queue(size)
+
+    async def produce():
+        try:
+            async for chunk in chunks:
+                await queue.put(chunk)
+
+            await queue.put(None)
+        except Exception as e:
+            await queue.put(e)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            chunk = await queue.get()
+            if chunk is None:
+                return
+
+            if isinstance(chunk, Exception):
+                raise chunk
+
+            yield chunk
+    finally:
+        producer.cancel()
+
+
+def iter_response(response):
+    chunks = response.aiter_raw(settings.PROXY_DEBRID_STREAM_CHUNK_SIZE or None)
+    if settings.PROXY_DEBRID_STREAM_READ_AHEAD > 0:
+        chunks = read_ahead(chunks, settings.PROXY_DEBRID_STREAM_READ_AHEAD)
+
+    return chunks
+
+
+def first_segment_range(start: int, end: int = None):
+    # Range of the request opened before answering the client when segments are used
+    segment_end = start + settings.PROXY_DEBRID_STREAM_SEGMENT_SIZE - 1
+    if end is not None:
+        segment_end = min(segment_end, end)
+
+    return f"bytes={start}-{segment_end}"
+
+
+async def fetch_segment(
+    open_upstream, start: int, end: int, queue: asyncio.Queue, response=None
+):
+    try:
+        if response is None:
+            response = await open_upstream(f"bytes={start}-{end}")
+
+        if response.status_code != 206:
+            raise Exception(f"status {response.status_code} for bytes={start}-{end}")
+
+        received = 0
+        async for chunk in response.aiter_raw(
+            settings.PROXY_DEBRID_STREAM_CHUNK_SIZE or None
+        ):
+            received += len(chunk)
+            queue.put_nowait(chunk)
+
+        if received != end - start + 1:
+            raise Exception(f"got {received} bytes for bytes={start}-{end}")
+
+        queue.put_nowait(None)
+    except Exception as e:
+        queue.put_nowait(e)
+    finally:
+        if response is not None:
+            await response.aclose()
+
+
+async def iter_segments(open_upstream, start: int, end: int, response=None):
+    # The first PROXY_DEBRID_STREAM_SEGMENTED_BYTES are fetched with parallel range
+    # requests and relayed in order, at most PROXY_DEBRID_STREAM_SEGMENTS segments
+    # are buffered - the rest is streamed with a single request
+    segment_size = settings.PROXY_DEBRID_STREAM_SEGMENT_SIZE
+    segmented_end = min(
+        end,
+        start + max(settings.PROXY_DEBRID_STREAM_SEGMENTED_BYTES, segment_size) - 1,
+    )
+    segments = deque(
+        (position, min(position + segment_size - 1, segmented_end))
+        for position in range(start, segmented_end + 1, segment_size)
+    )
+
+    fetching = deque()
+    tail = None
+    try:
+        while segments or fetching:
+            while segments and len(fetching) < settings.PROXY_DEBRID_STREAM_SEGMENTS:
+                segment_start, segment_end = segments.popleft()
+                queue = asyncio.Queue()
+                fetching.append(
+                    (
+                        queue,
+                        asyncio.create_task(
+                            fetch_segment(
+                                open_upstream,
+                                segment_start,
+                                segment_end,
+                                queue,
+                                response if segment_start == start else None,
+                            )
+                        ),
+                    )
+                )
+
+            if not segments and tail is None and segmented_end < end:
+                # Connect for the rest while the last segments are relayed
+                tail = asyncio.create_task(
+                    open_upstream(f"bytes={segmented_end + 1}-{end}")
+                )
+
+            queue, _ = fetching[0]
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+
+                if isinstance(chunk, Exception):
+                    logger.warning(f"Exception while fetching stream segment: {chunk}")
+                    return
+
+                yield chunk
+
+            fetching.popleft()
+
+        if tail is not None:
+            response = await tail
+            tail = None
+            try:
+                if response.status_code != 206:
+                    return
+
+                async for chunk in iter_response(response):
+                    yield chunk
+            finally:
+                await response.aclose()
+    finally:
+        for _, task in fetching:
+            task.cancel()
+
+        if tail is not None:
+            tail.cancel()
+            if tail.done() and not tail.cancelled() and tail.exception() is None:
+                await tail.result().aclose()
+
+
+async def iter_range(open_upstream, start: int, end: int, response=None):
+    # Bytes start-end of the file, response is already opened at start if given -
+    # it only covers the first segment when segments are used
+    if settings.PROXY_DEBRID_STREAM_SEGMENTS > 1:
+        async for chunk in iter_segments(open_upstream, start, end, response):
+            yield chunk
+
+        return
+
+    if response is None:
+        response = await open_upstream(f"bytes={start}-{end}")
+
+    try:
+        if response.status_code != 206:
+            return
+
+        async for chunk in iter_response(response):
+            yield chunk
+    finally:
+        await response.aclose()
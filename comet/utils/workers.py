@@ -0,0 +1,68 @@
+import asyncio
+import multiprocessing
+import sys
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from comet.utils.logger import logger
+from comet.utils.models import settings
+
+
+class WorkerPool:
+    def __init__(self):
+        self.executor = None
+        self.mode = "inline"
+
+    def start(self):
+        mode = settings.PARSE_EXECUTOR
+        if mode == "auto":
+            free_threaded = (
+                hasattr(sys, "_is_gil_enabled") and not sys._is_gil_enabled()
+            )
+            mode = "thread" if free_threaded else "process"
+
+        if mode == "process" and "fork" not in multiprocessing.get_all_start_methods():
+            # spawn/forkserver would re-import comet.main and start another server
+            logger.warning("Process parse executor needs fork, using threads instead")
+            mode = "thread"
+
+        if mode == "process":
+            self.executor = ProcessPoolExecutor(
+                max_workers=settings.PARSE_EXECUTOR_WORKERS,
+                mp_context=multiprocessing.get_context("fork"),
+            )
+        elif mode == "thread":
+            self.executor = ThreadPoolExecutor(
+                max_workers=settings.PARSE_EXECUTOR_WORKERS,
+                thread_name_prefix="comet-parse",
+            )
+        else:
+            mode = "inline"
+
+        self.mode = mode
+
+    async def map_chunks(self, func, items: list, *args):
+        # func(chunk, *args) must return a list, results are concatenated in order
+        if self.executor is None or len(items) < settings.PARSE_INLINE_THRESHOLD:
+            return func(items, *args)
+
+        loop = asyncio.get_running_loop()
+        chunk_size = settings.PARSE_CHUNK_SIZE
+        chunks = await asyncio.gather(
+            *[
+                loop.run_in_executor(
+                    self.executor, func, items[i : i + chunk_size], *args
+                )
+                for i in range(0, len(items), chunk_size)
+            ]
+        )
+
+        return [result for chunk in chunks for result in chunk]
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+            self.executor = None
+
+
+workers = WorkerPool()